@@ -1,5 +1,19 @@
+import glob
+import hashlib
+import heapq
+import json
+import multiprocessing
+import time
+import tracemalloc
+from array import array
+from functools import reduce
+from itertools import islice
+from collections import OrderedDict
+
 import numpy as np
 
+from pipeline_stats import NO_STATS
+
 """
 NYU NLP Homework 3: Implement a Viterbi HMM POS tagger
     by WENJIE ZHANG (WZ2427)
@@ -33,6 +47,35 @@ def classify_oov_word(word, oov_probabilities):
     return max(oov_probabilities, key=oov_probabilities.get, default="NN")
 
 
+_suffix_rank = {suffix: rank for rank, suffix in enumerate(suffix_classes)}
+_suffix_lengths = sorted({len(suffix) for suffix in suffix_classes})
+
+
+def oov_signature(word):
+    """
+    Collapses an OOV word to the one feature classify_oov_word() decides on: its first
+    matching suffix, else digit, capitalized, punctuation or other. Costs one dict lookup
+    per suffix length instead of a scan over every suffix.
+    """
+    matches = [word[-n:] for n in _suffix_lengths if len(word) >= n and word[-n:] in _suffix_rank]
+    if matches:
+        return "-" + min(matches, key=_suffix_rank.get)
+    if word.isdigit():
+        return "digit"
+    if word[0].isupper():
+        return "capitalized"
+    if not word.isalnum():
+        return "punct"
+    return "other"
+
+
+def signature_tags(oov_probabilities):
+    signatures = {"-" + suffix: tag for suffix, tag in suffix_classes.items()}
+    signatures.update({"digit": "CD", "capitalized": "NNP", "punct": "."})
+    signatures["other"] = max(oov_probabilities, key=oov_probabilities.get, default="NN")
+    return signatures
+
+
 def load_training_data(file_path):
     word_tag_counts = {}
     tag_counts = {}
@@ -151,36 +194,1016 @@ def viterbi(words, prior_probs, transition_probs, likelihood_probs, vocab, oov_p
     return list(reversed(best_path))
 
 
-def tag_corpus(input_file, output_file, prior_probs, transition_probs, likelihood_probs, vocab, oov_probabilities):
-    with open(input_file, 'r') as fin, open(output_file, 'w') as fout:
-        sentence = []
-        for line in fin:
+LOG_FLOOR = np.log(1e-6)
+
+
+class HMMTables:
+    """Dense log-space view of the probability dicts, built once per model."""
+
+    def __init__(self, tags, word_index, log_prior, log_trans, emit_indptr, emit_indices, emit_data,
+                 oov_probabilities, model_file=None, emission_cache_size=50000, counts=None, log_floor=LOG_FLOOR,
+                 oov_vectors=None):
+        self.tags = tags
+        self.tag_index = {tag: i for i, tag in enumerate(tags)}
+        self.word_index = word_index
+        self.log_prior = log_prior          # (m,)   log P(tag)
+        self.log_trans = log_trans          # (m, m) log P(cur | prev), rows are prev
+        self.emit_indptr = emit_indptr      # CSR over words, columns are tags
+        self.emit_indices = emit_indices
+        self.emit_data = emit_data          # log P(word | tag) for the seen (word, tag) pairs
+        self.oov_probabilities = oov_probabilities
+        self.model_file = model_file        # set when the tables are mapped from a compiled model
+        self.log_floor = log_floor          # log-prob of a missing emission or transition
+        # signature -> emission log-prob vector for OOV words; None borrows rows as viterbi() does
+        self.oov_vectors = oov_vectors
+
+        # Raw counts behind the probabilities, needed by update(): (tag_counts, bigram_counts,
+        # emit_counts) with emit_counts lined up with emit_data. None for dict-built tables.
+        self.tag_counts, self.bigram_counts, self.emit_counts = counts if counts is not None else (None, None, None)
+
+        self.emission_cache_size = emission_cache_size
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.signature_lookups = 0
+        self._refresh_derived()
+
+    def _refresh_derived(self):
+        # Rows are cur and columns are prev in reverse order, so the max over prev runs along the
+        # contiguous last axis and argmax lands on the last prev among ties, as viterbi() does
+        self.log_trans_rev_t = np.ascontiguousarray(self.log_trans.T[:, ::-1])
+        self.log_trans_rows = self.log_trans.tolist()  # for the small per-token loops in viterbi_pruned()
+        # Probability space copies for the scaled forward-backward pass
+        self.prior = np.exp(self.log_prior)
+        self.trans = np.exp(self.log_trans)
+        # Each step of full Viterbi reads every transition, so this many of them hit the 1e-6 floor
+        self.transition_fallbacks = int(np.count_nonzero(self.log_trans == self.log_floor))
+        self._build_signature_vectors()
+
+        # Bounded LRU of word -> emission log-prob vector for known words; OOV words go by signature
+        self.emission_cache = OrderedDict()
+        self._row_fallbacks = None
+        self._version = None
+
+    def version(self):
+        """Fingerprint of everything decoding depends on; changes whenever the probabilities do."""
+        if self._version is None:
+            digest = hashlib.sha1(json.dumps([self.tags, self.oov_probabilities, self.log_floor]).encode("utf-8"))
+            digest.update("\n".join(sorted(self.word_index, key=self.word_index.get)).encode("utf-8"))
+            for a in (self.log_prior, self.log_trans, self.emit_indptr, self.emit_indices, self.emit_data):
+                digest.update(np.ascontiguousarray(a).tobytes())
+            for signature in sorted(self.oov_vectors or ()):
+                digest.update(signature.encode("utf-8") + self.oov_vectors[signature].tobytes())
+            self._version = digest.hexdigest()[:16]
+        return self._version
+
+    def update(self, sentences):
+        """
+        Adds the counts of a few tagged sentences (lists of (word, tag) pairs) and renormalizes
+        only what they touch: the transition rows and emission entries of tags whose count
+        changed, plus the prior and OOV distribution. Unseen words and tags are appended.
+        """
+        if self.tag_counts is None:
+            raise ValueError("these tables have no raw counts; build them with normalize_counts() to update them")
+
+        word_ids, tag_ids = array('i'), array('i')
+        for sentence in sentences:
+            for word, tag in sentence:
+                word_ids.append(self.word_index.setdefault(word, len(self.word_index)))
+                tag_ids.append(self.tag_index.setdefault(tag, len(self.tag_index)))
+            word_ids.append(-1)
+            tag_ids.append(-1)
+
+        old_m, m = len(self.tags), len(self.tag_index)
+        n_words = len(self.word_index)
+        self.tags += list(self.tag_index)[old_m:]
+        tag_delta, bigram_delta, new_words, new_tags, new_counts = count_arrays(word_ids, tag_ids, n_words, m)
+
+        tag_counts = np.zeros(m, dtype=np.int64)
+        tag_counts[:old_m] = self.tag_counts
+        tag_counts += tag_delta
+        bigram_counts = np.zeros((m, m), dtype=np.int64)
+        bigram_counts[:old_m, :old_m] = self.bigram_counts
+        bigram_counts += bigram_delta
+        affected = np.flatnonzero(tag_delta)
+
+        log_trans = np.full((m, m), self.log_floor)
+        log_trans[:old_m, :old_m] = self.log_trans
+        rows = bigram_counts[affected]
+        with np.errstate(divide='ignore'):
+            log_trans[affected] = np.where(rows > 0, np.log(rows / tag_counts[affected, None]), self.log_floor)
+
+        # Fold the new (word, tag) counts into the CSR entries; the old log-probs are kept for
+        # every tag whose count did not change
+        old_rows = np.repeat(np.arange(len(self.emit_indptr) - 1), np.diff(self.emit_indptr))
+        packed = np.concatenate([old_rows * m + self.emit_indices, new_words.astype(np.int64) * m + new_tags])
+        keys, inverse = np.unique(packed, return_inverse=True)
+        emit_counts = np.bincount(inverse, weights=np.concatenate([self.emit_counts, new_counts]),
+                                  minlength=len(keys)).astype(np.int64)
+        emit_rows, emit_indices = keys // m, keys % m
+
+        emit_data = np.empty(len(keys))
+        emit_data[inverse[:len(old_rows)]] = self.emit_data
+        stale = np.isin(emit_indices, affected)
+        emit_data[stale] = np.log(emit_counts[stale] / tag_counts[emit_indices[stale]])
+
+        emit_indptr = np.zeros(n_words + 1, dtype=np.int64)
+        np.cumsum(np.bincount(emit_rows, minlength=n_words), out=emit_indptr[1:])
+
+        self.tag_counts, self.bigram_counts, self.emit_counts = tag_counts, bigram_counts, emit_counts
+        self.log_prior = np.log(tag_counts / tag_counts.sum())
+        self.log_trans = log_trans
+        self.emit_indptr, self.emit_indices, self.emit_data = emit_indptr, emit_indices, emit_data
+        self.oov_probabilities = oov_distribution(self.tags, emit_rows, emit_indices, emit_counts, n_words)
+        self.model_file = None
+        self._refresh_derived()
+
+    def _row_vector(self, row):
+        vector = np.full(len(self.tags), self.log_floor)
+        if row is not None:
+            start, end = self.emit_indptr[row], self.emit_indptr[row + 1]
+            vector[self.emit_indices[start:end]] = self.emit_data[start:end]
+        return vector
+
+    def _build_signature_vectors(self):
+        if self.oov_vectors is not None:
+            self.signature_vectors = self.oov_vectors
+        else:
+            # An OOV word borrows the emission row of its guessed tag string, exactly as viterbi() does,
+            # so every OOV word with the same signature gets the same vector
+            self.signature_vectors = {signature: self._row_vector(self.word_index.get(tag))
+                                      for signature, tag in signature_tags(self.oov_probabilities).items()}
+        self.signature_fallbacks = {signature: int(np.count_nonzero(vector == self.log_floor))
+                                    for signature, vector in self.signature_vectors.items()}
+
+    def emission_vector(self, word):
+        vector = self.emission_cache.get(word)
+        if vector is not None:
+            self.emission_cache.move_to_end(word)
+            self.cache_hits += 1
+            return vector
+
+        row = self.word_index.get(word)
+        if row is None:
+            self.signature_lookups += 1
+            return self.signature_vectors[oov_signature(word)]
+
+        self.cache_misses += 1
+        vector = self._row_vector(row)
+        self.emission_cache[word] = vector
+        if len(self.emission_cache) > self.emission_cache_size:
+            self.emission_cache.popitem(last=False)
+        return vector
+
+    def emissions(self, words):
+        if not words:
+            return np.empty((0, len(self.tags)))
+        return np.stack([self.emission_vector(word) for word in words])
+
+    def emission_fallbacks(self, words):
+        """
+        How many entries of emissions(words) are at the floor, worked out from the CSR rows and
+        the OOV signatures, so collecting stats does not go through the emission cache.
+        """
+        if self._row_fallbacks is None:
+            nnz = np.diff(self.emit_indptr)
+            stored = np.bincount(np.repeat(np.arange(len(nnz)), nnz), weights=self.emit_data == self.log_floor,
+                                 minlength=len(nnz))
+            self._row_fallbacks = (len(self.tags) - nnz + stored.astype(np.int64)).tolist()
+        total = 0
+        for word in words:
+            row = self.word_index.get(word)
+            total += self._row_fallbacks[row] if row is not None else self.signature_fallbacks[oov_signature(word)]
+        return total
+
+    def emission_cache_info(self):
+        lookups = self.cache_hits + self.cache_misses
+        return {"hits": self.cache_hits, "misses": self.cache_misses, "oov_signature_lookups": self.signature_lookups,
+                "size": len(self.emission_cache), "maxsize": self.emission_cache_size,
+                "hit_rate": self.cache_hits / lookups if lookups else 0.0}
+
+
+def build_hmm_tables(prior_probs, transition_probs, likelihood_probs, vocab, oov_probabilities):
+    tags = list(prior_probs.keys())
+    tag_index = {tag: i for i, tag in enumerate(tags)}
+    m = len(tags)
+
+    log_prior = np.log(np.array([prior_probs.get(tag, 1e-6) for tag in tags]))
+
+    log_trans = np.full((m, m), LOG_FLOOR)
+    for prev_tag, next_tags in transition_probs.items():
+        for tag, prob in next_tags.items():
+            log_trans[tag_index[prev_tag], tag_index[tag]] = np.log(prob)
+
+    word_index = {word: i for i, word in enumerate(sorted(vocab))}
+    rows, cols, data = [], [], []
+    for tag, words in likelihood_probs.items():
+        for word, prob in words.items():
+            rows.append(word_index[word])
+            cols.append(tag_index[tag])
+            data.append(prob)
+
+    rows = np.array(rows, dtype=np.int64)
+    cols = np.array(cols, dtype=np.int64)
+    order = np.lexsort((cols, rows))
+    emit_indptr = np.zeros(len(word_index) + 1, dtype=np.int64)
+    np.cumsum(np.bincount(rows, minlength=len(word_index)), out=emit_indptr[1:])
+    emit_indices = cols[order]
+    emit_data = np.log(np.array(data, dtype=np.float64)[order])
+
+    return HMMTables(tags, word_index, log_prior, log_trans, emit_indptr, emit_indices, emit_data,
+                     oov_probabilities)
+
+
+class HMMCounts:
+    """Count tables with words and tags interned to integer IDs; the array form of load_training_data()."""
+
+    def __init__(self, tags, words, tag_counts, bigram_counts, emit_words, emit_tags, emit_counts):
+        self.tags = tags                    # tag strings, in first-seen order
+        self.words = words                  # word strings, in first-seen order
+        self.tag_counts = tag_counts        # (m,)   C(tag)
+        self.bigram_counts = bigram_counts  # (m, m) C(prev, cur) within a sentence
+        self.emit_words = emit_words        # COO over (word, tag), sorted by word then tag
+        self.emit_tags = emit_tags
+        self.emit_counts = emit_counts      # C(word, tag)
+
+    def nbytes(self):
+        return sum(a.nbytes for a in (self.tag_counts, self.bigram_counts, self.emit_words, self.emit_tags,
+                                      self.emit_counts))
+
+    def merge(self, other):
+        """
+        Returns the counts of self followed by other. IDs are re-interned so new words and tags
+        keep first-seen order, which makes merging associative and equal to counting the
+        concatenated data in one pass.
+        """
+        tags = list(self.tags)
+        tag_index = {tag: i for i, tag in enumerate(tags)}
+        tag_map = np.array([tag_index.setdefault(tag, len(tag_index)) for tag in other.tags], dtype=np.int64)
+        tags += list(tag_index)[len(tags):]
+
+        words = list(self.words)
+        word_index = {word: i for i, word in enumerate(words)}
+        word_map = np.array([word_index.setdefault(word, len(word_index)) for word in other.words], dtype=np.int64)
+        words += list(word_index)[len(words):]
+
+        m = len(tags)
+        tag_counts = np.zeros(m, dtype=np.int64)
+        tag_counts[:len(self.tags)] += self.tag_counts
+        np.add.at(tag_counts, tag_map, other.tag_counts)
+
+        bigram_counts = np.zeros((m, m), dtype=np.int64)
+        bigram_counts[:len(self.tags), :len(self.tags)] += self.bigram_counts
+        np.add.at(bigram_counts, (tag_map[:, None], tag_map[None, :]), other.bigram_counts)
+
+        packed = np.concatenate([self.emit_words.astype(np.int64) * m + self.emit_tags,
+                                 word_map[other.emit_words] * m + tag_map[other.emit_tags]])
+        keys, inverse = np.unique(packed, return_inverse=True)
+        emit_counts = np.bincount(inverse, weights=np.concatenate([self.emit_counts, other.emit_counts]),
+                                  minlength=len(keys)).astype(np.int64)
+
+        return HMMCounts(tags, words, tag_counts, bigram_counts, keys // m, keys % m, emit_counts)
+
+
+def count_arrays(word_ids, tag_ids, n_words, n_tags):
+    """Counts from flat ID arrays where -1 in tag_ids marks a sentence break."""
+    word_ids = np.asarray(word_ids)
+    tag_ids = np.asarray(tag_ids)
+    tokens = tag_ids >= 0
+
+    tag_counts = np.bincount(tag_ids[tokens], minlength=n_tags)
+
+    # A bigram is any two adjacent tokens with no break between them
+    prev, cur = tag_ids[:-1], tag_ids[1:]
+    within = (prev >= 0) & (cur >= 0)
+    bigram_counts = np.bincount(prev[within].astype(np.int64) * n_tags + cur[within],
+                                minlength=n_tags * n_tags).reshape(n_tags, n_tags)
+
+    # np.unique on the packed (word, tag) key gives a COO accumulator already sorted by word then tag
+    keys, emit_counts = np.unique(word_ids[tokens].astype(np.int64) * n_tags + tag_ids[tokens], return_counts=True)
+    return tag_counts, bigram_counts, keys // n_tags, keys % n_tags, emit_counts
+
+
+def read_training_ids(file_path):
+    """Interns a .pos file: returns (words, tags, word_ids, tag_ids), with -1 marking sentence breaks."""
+    word_index, tag_index = {}, {}
+    word_ids, tag_ids = array('i'), array('i')
+
+    with open(file_path, 'r') as f:
+        for line in f:
             line = line.strip()
             if not line:
-                if sentence:
-                    tags = viterbi(sentence, prior_probs, transition_probs, likelihood_probs, vocab, oov_probabilities)
-                    fout.writelines(f"{w}\t{t}\n" for w, t in zip(sentence, tags))
-                    fout.write("\n")
-                    sentence = []
+                word_ids.append(-1)
+                tag_ids.append(-1)
+                continue
+
+            word, tag = line.split()
+            word_ids.append(word_index.setdefault(word, len(word_index)))
+            tag_ids.append(tag_index.setdefault(tag, len(tag_index)))
+
+    return list(word_index), list(tag_index), word_ids, tag_ids
+
+
+def load_training_counts(file_path, stats=NO_STATS):
+    with stats.stage("load"):
+        words, tags, word_ids, tag_ids = read_training_ids(file_path)
+
+    with stats.stage("count"):
+        tag_counts, bigram_counts, emit_words, emit_tags, emit_counts = count_arrays(
+            word_ids, tag_ids, len(words), len(tags))
+    stats.count("training_tokens", len(tag_ids) - tag_ids.count(-1))
+    return HMMCounts(tags, words, tag_counts, bigram_counts, emit_words, emit_tags, emit_counts)
+
+
+def expand_training_paths(paths):
+    """Accepts a path, a glob pattern or a list of either; returns the matching files in order."""
+    if isinstance(paths, str):
+        paths = [paths]
+    files = []
+    for path in paths:
+        matches = sorted(glob.glob(path))
+        files += matches if matches else [path]
+    return files
+
+
+def train_counts(paths, workers=None):
+    """
+    Map-reduce counting over several .pos files: each file is counted in its own process and
+    the partial HMMCounts are merged in input order. Every file is treated as ending with a
+    sentence break, as load_training_data() does when it reaches the end of a file.
+    """
+    files = expand_training_paths(paths)
+    if workers and workers > 1 and len(files) > 1:
+        with multiprocessing.Pool(min(workers, len(files))) as pool:
+            shards = pool.map(load_training_counts, files)
+    else:
+        shards = [load_training_counts(path) for path in files]
+    return reduce(HMMCounts.merge, shards)
+
+
+def oov_distribution(tags, emit_words, emit_tags, emit_counts, n_words):
+    # Rare (seen once) words vote for their tag in the OOV distribution
+    word_counts = np.bincount(emit_words, weights=emit_counts, minlength=n_words)
+    rare = word_counts[emit_words] == 1
+    rare_tags = np.bincount(emit_tags[rare], minlength=len(tags))
+    if rare_tags.sum() > 0:
+        oov = rare_tags / rare_tags.sum()
+    else:
+        oov = np.full(len(tags), 1 / len(tags))
+    return {tag: float(p) for tag, p in zip(tags, oov)}
+
+
+def normalize_counts(counts):
+    """Vectorized compute_probabilities() + compute_oov_probabilities() + build_hmm_tables()."""
+    tag_counts = counts.tag_counts
+
+    log_prior = np.log(tag_counts / tag_counts.sum())
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        log_trans = np.where(counts.bigram_counts > 0, np.log(counts.bigram_counts / tag_counts[:, None]), LOG_FLOOR)
+
+    oov_probabilities = oov_distribution(counts.tags, counts.emit_words, counts.emit_tags, counts.emit_counts,
+                                         len(counts.words))
+
+    # Re-number words alphabetically, as build_hmm_tables() does, so both paths give the same tables
+    order = sorted(range(len(counts.words)), key=counts.words.__getitem__)
+    rank = np.empty(len(order), dtype=np.int64)
+    rank[order] = np.arange(len(order))
+    rows = rank[counts.emit_words]
+    entries = np.lexsort((counts.emit_tags, rows))
+
+    emit_indptr = np.zeros(len(order) + 1, dtype=np.int64)
+    np.cumsum(np.bincount(rows, minlength=len(order)), out=emit_indptr[1:])
+    emit_indices = counts.emit_tags[entries]
+    emit_data = np.log(counts.emit_counts[entries] / tag_counts[emit_indices])
+
+    word_index = {counts.words[i]: r for r, i in enumerate(order)}
+    return HMMTables(list(counts.tags), word_index, log_prior, log_trans, emit_indptr, emit_indices, emit_data,
+                     oov_probabilities, counts=(tag_counts, counts.bigram_counts, counts.emit_counts[entries]))
+
+
+def compare_count_stores(file_path):
+    """Prints build time and peak memory of the dict counts against the array counts."""
+    report = {}
+    for name, build in (("dict", load_training_data), ("array", load_training_counts)):
+        start = time.perf_counter()
+        build(file_path)
+        elapsed = time.perf_counter() - start
+
+        # Traced separately, since tracemalloc slows allocation-heavy code down a lot
+        tracemalloc.start()
+        result = build(file_path)
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        del result
+        report[name] = {"seconds": elapsed, "retained_bytes": current, "peak_bytes": peak}
+
+    for name, row in report.items():
+        print(f"{name:<6} build {row['seconds']:.3f}s  retained {row['retained_bytes'] / 2 ** 20:.1f} MiB  "
+              f"peak {row['peak_bytes'] / 2 ** 20:.1f} MiB")
+    return report
+
+
+def viterbi_lattice(words, tables):
+    """
+    The forward pass of viterbi_log(): returns the emissions, every column of Viterbi scores
+    (score[t, i] = best log-probability of a prefix ending in tag i at t) and the backpointers.
+    """
+    emit = tables.emissions(words)
+    n, m = emit.shape
+    score = np.empty((n, m))
+    backpointer = np.zeros((n, m), dtype=np.int64)
+    cols = np.arange(m)
+
+    score[0] = tables.log_prior + emit[0]
+    for t in range(1, n):
+        # candidates[i, m - 1 - j] = score of reaching tag i at t through tag j at t - 1
+        candidates = score[t - 1, ::-1] + tables.log_trans_rev_t
+        best = np.argmax(candidates, axis=1)
+        backpointer[t] = m - 1 - best
+        score[t] = candidates[cols, best] + emit[t]
+
+    return emit, score, backpointer
+
+
+def viterbi_log(words, tables):
+    _, score, backpointer = viterbi_lattice(words, tables)
+
+    best_path = [int(np.argmax(score[-1]))]
+    for t in range(len(words) - 1, 0, -1):
+        best_path.append(backpointer[t, best_path[-1]])
+
+    return [tables.tags[i] for i in reversed(best_path)]
+
+
+def _ranked(values, first):
+    # Indices by decreasing value, with `first` (the argmax the decoder already chose) in front
+    order = np.argsort(-values, kind='stable').tolist()
+    order.remove(first)
+    return [first] + order
+
+
+def iter_kbest(words, tables):
+    """
+    Yields (log-probability, tags) for every tagging of words, best first, lazily.
+
+    Best-first search from the last token back to the first. The Viterbi score of a tag is
+    the exact best score of any prefix ending in it, so a partial suffix is ranked by its
+    final score. The best predecessor of a state is its backpointer, so the first path
+    costs one Viterbi pass plus the backtrace. The other predecessors of a state are sorted
+    only when the search first asks for its second-best one, so each extra path costs about
+    one ranking per token where it differs from the paths already found.
+    """
+    if not words:
+        return
+    emit, score, backpointer = viterbi_lattice(words, tables)
+    n = len(words)
+    orders = {}
+
+    def predecessors(t, j):
+        # Tags at t - 1 ranked by how well they reach tag j at t; (n, None) ranks the last tag
+        if (t, j) not in orders:
+            if t == n:
+                orders[t, j] = _ranked(score[-1], int(np.argmax(score[-1])))
+            else:
+                orders[t, j] = _ranked(score[t - 1] + tables.log_trans[:, j], int(backpointer[t, j]))
+        return orders[t, j]
+
+    # Heap entries: (-priority, is_placeholder, counter, payload). A node is a suffix fixing
+    # tag j at t; g is the log-probability of everything after t given j. A placeholder stands
+    # in for the next-ranked sibling of a popped node, at that node's priority, which bounds it
+    # from above; it is only scored when it reaches the top.
+    counter = 0
+    last = int(np.argmax(score[-1]))
+    heap = [(-score[-1, last], False, counter, (n - 1, last, 0.0, None, 0))]
+    while heap:
+        priority, placeholder, _, payload = heapq.heappop(heap)
+        if placeholder:
+            parent, t, rank = payload
+            if parent is None:
+                j, g = predecessors(n, None)[rank], 0.0
             else:
-                sentence.append(line)
+                pt, pj, pg = parent[0], parent[1], parent[2]
+                j = predecessors(pt, pj)[rank]
+                g = pg + emit[pt, pj] + tables.log_trans[j, pj]
+            counter += 1
+            heapq.heappush(heap, (-(score[t, j] + g), False, counter, (t, j, g, parent, rank)))
+            continue
+
+        t, j, g, parent, rank = node = payload
+        if rank + 1 < len(tables.tags):
+            counter += 1
+            heapq.heappush(heap, (priority, True, counter, (parent, t, rank + 1)))
+        if t == 0:
+            path = []
+            while node is not None:
+                path.append(tables.tags[node[1]])
+                node = node[3]
+            yield -priority, path
+            continue
+
+        # The best predecessor reaches exactly this node's priority, so it is not re-scored
+        i = int(backpointer[t, j])
+        counter += 1
+        heapq.heappush(heap, (priority, False, counter, (t - 1, i, g + emit[t, j] + tables.log_trans[i, j], node, 0)))
+
+
+def viterbi_kbest(words, tables, k):
+    """The k best taggings of words as (log-probability, tags), best first."""
+    return list(islice(iter_kbest(words, tables), k))
+
+
+def length_batches(sentences, batch_size):
+    """
+    Yields (length, indices) for groups of at most batch_size non-empty sentences of the same
+    length, so each group is a dense (batch, length, tags) tensor with no padding.
+    """
+    buckets = {}
+    for i, sentence in enumerate(sentences):
+        if sentence:
+            buckets.setdefault(len(sentence), []).append(i)
+
+    for n, members in buckets.items():
+        for b in range(0, len(members), batch_size):
+            yield n, members[b:b + batch_size]
+
+
+def viterbi_batch(sentences, tables, batch_size=256):
+    """Decodes many sentences at once; returns their tag lists in input order ([] for an empty sentence)."""
+    results = [[] for _ in sentences]
+    m = len(tables.tags)
+
+    for n, batch in length_batches(sentences, batch_size):
+        words = [word for i in batch for word in sentences[i]]
+        emit = tables.emissions(words).reshape(len(batch), n, m)
+        backpointer = np.zeros((len(batch), n, m), dtype=np.int64)
+
+        flat = np.arange(len(batch) * m)
+        score = tables.log_prior + emit[:, 0]
+        for t in range(1, n):
+            candidates = (score[:, None, ::-1] + tables.log_trans_rev_t).reshape(-1, m)
+            best = np.argmax(candidates, axis=1)
+            backpointer[:, t] = (m - 1 - best).reshape(len(batch), m)
+            score = candidates[flat, best].reshape(len(batch), m) + emit[:, t]
+
+        path = np.zeros((len(batch), n), dtype=np.int64)
+        path[:, -1] = np.argmax(score, axis=1)
+        rows = np.arange(len(batch))
+        for t in range(n - 1, 0, -1):
+            path[:, t - 1] = backpointer[rows, t, path[:, t]]
+
+        for i, tag_ids in zip(batch, path):
+            results[i] = [tables.tags[k] for k in tag_ids]
+
+    return results
+
+
+def forward_backward(emit, prior, trans):
+    """
+    Scaled forward-backward over a (batch, length, tags) tensor of emission probabilities.
+    Each forward step is renormalized to sum to one, so long sentences cannot underflow.
+    Returns alpha, beta and the per-step scales: alpha * beta is proportional to the tag
+    posteriors, and the sum of log(scale) over a sentence is its log-likelihood.
+    """
+    batch, n, m = emit.shape
+    alpha = np.empty((batch, n, m))
+    beta = np.empty((batch, n, m))
+    scale = np.empty((batch, n))
+
+    alpha[:, 0] = prior * emit[:, 0]
+    for t in range(n):
+        if t:
+            alpha[:, t] = (alpha[:, t - 1] @ trans) * emit[:, t]
+        scale[:, t] = alpha[:, t].sum(axis=1)
+        alpha[:, t] /= scale[:, t, None]
+
+    beta[:, -1] = 1.0
+    for t in range(n - 2, -1, -1):
+        beta[:, t] = ((emit[:, t + 1] * beta[:, t + 1]) @ trans.T) / scale[:, t + 1, None]
+
+    return alpha, beta, scale
+
+
+def posteriors_batch(sentences, tables, batch_size=256):
+    """
+    Per-token tag distributions for many sentences at once: one (length, tags) array per
+    sentence in input order, each row summing to one, columns in tables.tags order.
+    """
+    m = len(tables.tags)
+    results = [np.empty((0, m))] * len(sentences)
+
+    for n, batch in length_batches(sentences, batch_size):
+        words = [word for i in batch for word in sentences[i]]
+        emit = np.exp(tables.emissions(words)).reshape(len(batch), n, m)
+        alpha, beta, _ = forward_backward(emit, tables.prior, tables.trans)
+        gamma = alpha * beta
+        gamma /= gamma.sum(axis=2, keepdims=True)
+        for i, posterior in zip(batch, gamma):
+            results[i] = posterior
+
+    return results
+
+
+def tag_confidences(sentences, tables, batch_size=256):
+    """For each sentence, the most probable tag of every token and its posterior, as (tag, probability) pairs."""
+    results = []
+    for posterior in posteriors_batch(sentences, tables, batch_size):
+        best = np.argmax(posterior, axis=1)
+        confidence = posterior[np.arange(len(best)), best]
+        results.append([(tables.tags[k], float(p)) for k, p in zip(best, confidence)])
+    return results
+
+
+def _beam_keep(score, beam):
+    """
+    Indices of the `beam` best scores in each row of score, in state order. Ties go to the
+    earlier state, as with heapq.nlargest: argpartition makes the cut, and only rows where
+    the cut splits a tie are re-ranked with a stable sort.
+    """
+    n = score.shape[1]
+    keep = np.argpartition(score, n - beam, axis=1)[:, n - beam:]
+    # argpartition puts the beam-th best score first; more scores reaching it means a split tie
+    kth = score[np.arange(len(score)), keep[:, 0]]
+    tied = np.count_nonzero(score >= kth[:, None], axis=1) > beam
+    if tied.any():
+        keep[tied] = np.argsort(-score[tied], axis=1, kind='stable')[:, :beam]
+    return np.sort(keep, axis=1)
+
+
+def viterbi_pruned(words, tables, tag_dict=True, beam=None):
+    """
+    Approximate Viterbi over a reduced state space. With tag_dict, a known word may only take
+    the tags it was seen with in training (OOV words keep every tag). With beam, only the
+    `beam` best states survive each position. Per-token work drops from O(T^2) to
+    O(|prev states| * |cur states|). Wide steps (OOV words, beam without tag_dict) run as a
+    few NumPy calls on arrays; only the small tag-dictionary steps, where call overhead
+    outweighs the arithmetic, run as plain Python loops on lists.
+    """
+    emit = tables.emissions(words)
+    emit_lists = None
+    trans = tables.log_trans_rows
+    m = len(tables.tags)
+    all_tags = np.arange(m)
+    states = []
+    backpointers = []
+
+    score = None
+    for t, word in enumerate(words):
+        cur = all_tags
+        if tag_dict:
+            row = tables.word_index.get(word)
+            if row is not None:
+                cur = tables.emit_indices[tables.emit_indptr[row]:tables.emit_indptr[row + 1]]
+
+        if t == 0:
+            score = tables.log_prior[cur] + emit[0, cur]
+            bp = None
+        elif cur is all_tags or len(states[-1]) * len(cur) > 64:
+            # Wide step: one (prev, cur) block; reversed so argmax ties go to the last previous state
+            prev = np.asarray(states[-1])[::-1]
+            candidates = np.asarray(score)[::-1, None] + \
+                (tables.log_trans[prev] if cur is all_tags else tables.log_trans[prev[:, None], cur])
+            best = np.argmax(candidates, axis=0)
+            bp = len(prev) - 1 - best
+            score = candidates[best, np.arange(len(cur))] + (emit[t] if cur is all_tags else emit[t, cur])
+        else:
+            if emit_lists is None:
+                emit_lists = emit.tolist()
+            prev = states[-1] if isinstance(states[-1], list) else states[-1].tolist()
+            if not isinstance(score, list):
+                score = score.tolist()
+            cur = cur.tolist()
+            emit_t = emit_lists[t]
+            if len(prev) == 1:
+                # The previous word was unambiguous: every state comes from it
+                row, first = trans[prev[0]], score[0]
+                score = [first + row[c] + emit_t[c] for c in cur]
+                bp = [0] * len(cur)
+            else:
+                new_score, bp = [], []
+                for c in cur:
+                    best, best_k = -np.inf, 0
+                    for k, p in enumerate(prev):
+                        value = score[k] + trans[p][c]
+                        if value >= best:  # ties go to the last previous state, as in viterbi()
+                            best, best_k = value, k
+                    new_score.append(best + emit_t[c])
+                    bp.append(best_k)
+                score = new_score
+
+        if beam and len(cur) > beam:
+            if isinstance(score, list):
+                # A stable sort of a few states; ties keep the earlier state, as heapq.nlargest does
+                keep = sorted(sorted(range(len(cur)), key=score.__getitem__, reverse=True)[:beam])
+                cur = [cur[k] for k in keep]
+                score = [score[k] for k in keep]
+                if bp is not None:
+                    bp = [bp[k] for k in keep]
+            else:
+                keep = _beam_keep(score[None], beam)[0]
+                cur, score = cur[keep], score[keep]
+                if bp is not None:
+                    bp = bp[keep]
+
+        states.append(cur)
+        backpointers.append(bp)
+
+    k = int(np.argmax(score))
+    best_path = [states[-1][k]]
+    for t in range(len(words) - 1, 0, -1):
+        k = backpointers[t][k]
+        best_path.append(states[t - 1][k])
+
+    return [tables.tags[i] for i in reversed(best_path)]
+
+
+def viterbi_beam_batch(sentences, tables, beam, batch_size=256):
+    """
+    viterbi_pruned(..., tag_dict=False, beam=beam) for many sentences at once: the beam
+    survivors of each length-bucketed group advance together, so a position costs a few
+    NumPy calls on (batch, beam, tags) blocks instead of a (batch, tags, tags) one.
+    """
+    m = len(tables.tags)
+    if beam >= m:
+        return viterbi_batch(sentences, tables, batch_size)
+    results = [[] for _ in sentences]
+
+    for n, batch in length_batches(sentences, batch_size):
+        words = [word for i in batch for word in sentences[i]]
+        emit = tables.emissions(words).reshape(len(batch), n, m)
+        rows = np.arange(len(batch))
+
+        score = tables.log_prior + emit[:, 0]
+        keep = _beam_keep(score, beam)
+        score = np.take_along_axis(score, keep, axis=1)
+        states, backpointers = [keep], [None]
+        for t in range(1, n):
+            # Previous states reversed, so argmax ties go to the last one, as in viterbi()
+            candidates = score[:, ::-1, None] + tables.log_trans[states[-1][:, ::-1]]
+            best = np.argmax(candidates, axis=1)
+            new_score = np.take_along_axis(candidates, best[:, None], axis=1)[:, 0] + emit[:, t]
+            keep = _beam_keep(new_score, beam)
+            backpointers.append(beam - 1 - np.take_along_axis(best, keep, axis=1))
+            states.append(keep)
+            score = np.take_along_axis(new_score, keep, axis=1)
+
+        path = np.zeros((len(batch), n), dtype=np.int64)
+        k = np.argmax(score, axis=1)
+        for t in range(n - 1, -1, -1):
+            path[:, t] = states[t][rows, k]
+            if t:
+                k = backpointers[t][rows, k]
+
+        for i, tag_ids in zip(batch, path):
+            results[i] = [tables.tags[k] for k in tag_ids]
+
+    return results
+
+
+def decode_sentences(sentences, tables, batch_size=None, tag_dict=False, beam=None):
+    if beam and not tag_dict:
+        return viterbi_beam_batch(sentences, tables, beam, batch_size or 256)
+    if tag_dict or beam:
+        return [viterbi_pruned(sentence, tables, tag_dict, beam) for sentence in sentences]
+    if batch_size:
+        return viterbi_batch(sentences, tables, batch_size)
+    return [viterbi_log(sentence, tables) for sentence in sentences]
+
+
+def iter_sentences(lines):
+    """
+    Yields each sentence (a list of tokens) from an iterable of one-token lines. A sentence
+    ends at a blank line or at the end of the input, so a last sentence without a trailing
+    blank line is not lost.
+    """
+    sentence = []
+    for line in lines:
+        line = line.strip()
+        if line:
+            sentence.append(line)
+        elif sentence:
+            yield sentence
+            sentence = []
+    if sentence:
+        yield sentence
+
+
+def read_sentences(input_file):
+    with open(input_file, 'r') as fin:
+        return list(iter_sentences(fin))
+
+
+_worker_tables = None
+
+
+def _init_worker(tables_or_file):
+    global _worker_tables
+    if isinstance(tables_or_file, str):
+        from hmm_store import load_model
+        _worker_tables = load_model(tables_or_file)
+    else:
+        _worker_tables = tables_or_file
+
+
+def _tag_shard(args):
+    sentences, options = args
+    return decode_sentences(sentences, _worker_tables, **options)
+
+
+def record_sentence_stats(stats, sentence, tables):
+    """OOV tokens, 1e-6 fallback hits and length of one sentence; only called when stats are enabled."""
+    stats.observe("sentence_length", len(sentence))
+    stats.count("sentences")
+    stats.count("tokens", len(sentence))
+    stats.count("oov_tokens", sum(word not in tables.word_index for word in sentence))
+    stats.count("emission_fallbacks", tables.emission_fallbacks(sentence))
+    stats.count("transition_fallbacks", (len(sentence) - 1) * tables.transition_fallbacks)
+
+
+def decode_cached(sentences, tables, cache, decode, tag_dict=False, beam=None):
+    """
+    Tags sentences through a SentenceCache: decode(list of sentences) is only called on the
+    distinct sentences the cache does not have, and its results are stored for next time.
+    """
+    model_key = (tables.version(), tag_dict, beam)
+    results = [None] * len(sentences)
+    missing = {}
+    for i, sentence in enumerate(sentences):
+        tokens = tuple(sentence)
+        if tokens in missing:
+            # Repeated within this chunk: decoded once below, so it counts as a hit
+            missing[tokens].append(i)
+            cache.hits += 1
+            continue
+        tags = cache.get((model_key, tokens))
+        if tags is None:
+            missing[tokens] = [i]
+        else:
+            results[i] = list(tags)
+
+    if missing:
+        for tokens, tags in zip(missing, decode([list(tokens) for tokens in missing])):
+            cache.put((model_key, tokens), tags)
+            for i in missing[tokens]:
+                results[i] = list(tags)
+    return results
+
+
+def tag_stream(lines, tables, batch_size=None, tag_dict=False, beam=None, stats=NO_STATS, window=4096,
+               cache=None):
+    """
+    Yields (sentence, tags) for every sentence in lines, decoding each one as soon as it ends.
+    With batch_size, up to `window` sentences are gathered and decoded with viterbi_batch()
+    first, which trades latency for throughput. Memory stays bounded either way. With a
+    SentenceCache, sentences tagged before by the same model are not decoded again.
+    """
+    options = {"batch_size": batch_size, "tag_dict": tag_dict, "beam": beam}
+    sentences = iter_sentences(lines)
+    chunk_size = window if batch_size else 1
+    while True:
+        with stats.stage("read"):
+            chunk = list(islice(sentences, chunk_size))
+        if not chunk:
+            return
+        with stats.stage("decode"):
+            if cache is None:
+                all_tags = decode_sentences(chunk, tables, **options)
+            else:
+                all_tags = decode_cached(chunk, tables, cache, lambda s: decode_sentences(s, tables, **options),
+                                         tag_dict, beam)
+        for sentence, tags in zip(chunk, all_tags):
+            if stats.enabled:
+                record_sentence_stats(stats, sentence, tables)
+            yield sentence, tags
+
+
+def _tag_stream_with_pool(lines, tables, workers, shard_size, options, stats, cache=None):
+    # Workers map a compiled model from disk themselves; in-memory tables are sent once per worker
+    source = tables.model_file or tables
+    sentences = iter_sentences(lines)
+    with multiprocessing.Pool(workers, initializer=_init_worker, initargs=(source,)) as pool:
+        def decode(chunk):
+            shards = [(chunk[i:i + shard_size], options) for i in range(0, len(chunk), shard_size)]
+            return [tags for shard_tags in pool.map(_tag_shard, shards) for tags in shard_tags]
+
+        while True:
+            # A few shards per worker at a time keeps memory bounded; map returns them in input order
+            with stats.stage("read"):
+                chunk = list(islice(sentences, workers * 2 * shard_size))
+            if not chunk:
+                return
+            with stats.stage("decode"):
+                if cache is None:
+                    all_tags = decode(chunk)
+                else:
+                    all_tags = decode_cached(chunk, tables, cache, decode, options["tag_dict"], options["beam"])
+            for sentence, tags in zip(chunk, all_tags):
+                if stats.enabled:
+                    record_sentence_stats(stats, sentence, tables)
+                yield sentence, tags
+
+
+def write_tagged(fout, tagged, buffer_sentences=256, stats=NO_STATS):
+    """Writes (sentence, tags) pairs in .pos format, buffer_sentences at a time, flushing each batch."""
+    buffer = []
+    for n, (sentence, tags) in enumerate(tagged, 1):
+        buffer.extend(f"{w}\t{t}\n" for w, t in zip(sentence, tags))
+        buffer.append("\n")
+        if n % buffer_sentences == 0:
+            with stats.stage("write"):
+                fout.write("".join(buffer))
+                fout.flush()
+            buffer = []
+    if buffer:
+        with stats.stage("write"):
+            fout.write("".join(buffer))
+            fout.flush()
+
+
+def tag_corpus(input_file, output_file, tables, batch_size=None, workers=None, shard_size=500,
+               tag_dict=False, beam=None, stats=NO_STATS, cache=None):
+    options = {"batch_size": batch_size, "tag_dict": tag_dict, "beam": beam}
+    before = cache.info() if cache is not None else None
+    with open(input_file, 'r') as fin, open(output_file, 'w') as fout:
+        if workers and workers > 1:
+            tagged = _tag_stream_with_pool(fin, tables, workers, shard_size, options, stats, cache)
+        else:
+            tagged = tag_stream(fin, tables, stats=stats, cache=cache, **options)
+        write_tagged(fout, tagged, stats=stats)
+
+    if cache is not None:
+        after = cache.info()
+        stats.count("sentence_cache_hits", after["hits"] - before["hits"])
+        stats.count("sentence_cache_misses", after["misses"] - before["misses"])
+
+
+def read_tagged_sentences(pos_file):
+    sentences, gold = [], []
+    with open(pos_file, 'r') as f:
+        words, tags = [], []
+        for line in f:
+            line = line.strip()
+            if not line:
+                if words:
+                    sentences.append(words)
+                    gold.append(tags)
+                    words, tags = [], []
+                continue
+            word, tag = line.split()
+            words.append(word)
+            tags.append(tag)
+        if words:
+            sentences.append(words)
+            gold.append(tags)
+    return sentences, gold
+
+
+def compare_decoders(tables, gold_file, beams=(1, 2, 4, 8)):
+    """Prints accuracy and speed of the pruned decoding modes against full Viterbi on a .pos file."""
+    sentences, gold = read_tagged_sentences(gold_file)
+    n_tokens = sum(len(s) for s in sentences)
+
+    modes = [("full", {})]
+    modes.append(("tag_dict", {"tag_dict": True}))
+    modes += [(f"beam={b}", {"beam": b}) for b in beams]
+    modes += [(f"tag_dict+beam={b}", {"tag_dict": True, "beam": b}) for b in beams]
+
+    report = []
+    full_tags = None
+    for name, options in modes:
+        start = time.perf_counter()
+        predicted = decode_sentences(sentences, tables, **options)
+        elapsed = time.perf_counter() - start
+        if full_tags is None:
+            full_tags = predicted
+
+        correct = sum(p == g for ps, gs in zip(predicted, gold) for p, g in zip(ps, gs))
+        agree = sum(p == f for ps, fs in zip(predicted, full_tags) for p, f in zip(ps, fs))
+        report.append({"mode": name, "accuracy": correct / n_tokens, "agreement_with_full": agree / n_tokens,
+                       "seconds": elapsed, "tokens_per_sec": n_tokens / elapsed})
+
+    print(f"{'mode':<20}{'accuracy':>10}{'vs full':>10}{'seconds':>10}{'tok/s':>12}")
+    for row in report:
+        print(f"{row['mode']:<20}{row['accuracy']:>10.4f}{row['agreement_with_full']:>10.4f}"
+              f"{row['seconds']:>10.3f}{row['tokens_per_sec']:>12.0f}")
+    return report
 
 
-def final_call(input_training_data, input_file, output_file):
-    tag_counts, word_tag_counts, bigram_counts, vocab, rare_word_counts = load_training_data(input_training_data)
+def final_call(input_training_data, input_file, output_file, stats=NO_STATS):
+    counts = load_training_counts(input_training_data, stats)
 
-    print(f"Total tags: {len(tag_counts)}, Total unique words: {len(word_tag_counts)}, "
-          f"Total bigrams: {len(bigram_counts)}, Vocabulary size: {len(vocab)}")
+    print(f"Total tags: {len(counts.tags)}, Total tokens: {counts.tag_counts.sum()}, "
+          f"Total bigrams: {np.count_nonzero(counts.bigram_counts)}, Vocabulary size: {len(counts.words)}")
 
-    oov_probabilities = compute_oov_probabilities(rare_word_counts, tag_counts)
-    prior_probs, transition_probs, likelihood_probs = compute_probabilities(tag_counts, word_tag_counts, bigram_counts)
+    with stats.stage("normalize"):
+        tables = normalize_counts(counts)
 
     print("Probability tables computed successfully!")
 
-    tag_corpus(input_file, output_file, prior_probs, transition_probs, likelihood_probs, vocab, oov_probabilities)
+    tag_corpus(input_file, output_file, tables, stats=stats)
 
     print(f"Tagging complete! Output saved to {output_file}")
 
 
 # Run the program
-final_call("WSJ_02-21.pos", "WSJ_23.words", "submission.pos")
+if __name__ == "__main__":
+    final_call("WSJ_02-21.pos", "WSJ_23.words", "submission.pos")
@@ -0,0 +1,183 @@
+"""
+Baum-Welch (EM) training of the HW3 HMM from untagged text.
+
+Starts from a supervised model and re-estimates the prior, transitions and emissions from
+the expected counts of the untagged sentences. The supervised counts are added back in
+with a weight each iteration (semi-supervised); with weight 0 the model is re-estimated
+from the untagged text alone. Emissions are only re-estimated for the (word, tag) pairs
+of the supervised tag dictionary, so the model keeps its sparse shape, and OOV words
+still go by their signature.
+
+The E-step runs forward-backward on length-bucketed batches, and with --workers the
+sentences are split into shards, one per worker process, that are counted in parallel.
+
+    python baum_welch.py WSJ_24.pos WSJ_23.words em.hmm --iterations 5 --workers 4 --gold WSJ_24.pos
+"""
+
+import argparse
+import multiprocessing
+import time
+
+import numpy as np
+
+from HW3 import (LOG_FLOOR, HMMTables, forward_backward, length_batches, load_training_counts, normalize_counts,
+                 read_sentences, read_tagged_sentences, viterbi_batch)
+from hmm_store import load_model, save_model
+
+
+def expected_counts(sentences, tables, batch_size=256):
+    """
+    E-step: expected tag, bigram and (word, tag) counts of the sentences under the model, with
+    the emission counts lined up with tables.emit_data, plus the total log-likelihood.
+    """
+    m = len(tables.tags)
+    tag_counts = np.zeros(m)
+    bigram_counts = np.zeros((m, m))
+    emit_counts = np.zeros(len(tables.emit_data))
+    log_likelihood = 0.0
+
+    for n, batch in length_batches(sentences, batch_size):
+        words = [word for i in batch for word in sentences[i]]
+        emit = np.exp(tables.emissions(words)).reshape(len(batch), n, m)
+        alpha, beta, scale = forward_backward(emit, tables.prior, tables.trans)
+        log_likelihood += np.log(scale).sum()
+
+        gamma = (alpha * beta).reshape(-1, m)
+        tag_counts += gamma.sum(axis=0)
+
+        # xi summed over every adjacent pair: alpha[t-1, i] * trans[i, j] * emit[t, j] * beta[t, j] / scale[t]
+        if n > 1:
+            before = alpha[:, :-1].reshape(-1, m)
+            after = (emit[:, 1:] * beta[:, 1:] / scale[:, 1:, None]).reshape(-1, m)
+            bigram_counts += (before.T @ after) * tables.trans
+
+        # Each known token adds its posterior to the CSR entries of its word
+        rows = np.array([tables.word_index.get(word, -1) for word in words])
+        tokens = np.flatnonzero(rows >= 0)
+        starts = tables.emit_indptr[rows[tokens]]
+        lengths = tables.emit_indptr[rows[tokens] + 1] - starts
+        entries = np.repeat(starts - np.cumsum(lengths) + lengths, lengths) + np.arange(lengths.sum())
+        weights = gamma[np.repeat(tokens, lengths), tables.emit_indices[entries]]
+        emit_counts += np.bincount(entries, weights=weights, minlength=len(emit_counts))
+
+    return tag_counts, bigram_counts, emit_counts, log_likelihood
+
+
+def reestimate(tables, tag_counts, bigram_counts, emit_counts):
+    """M-step: new tables with the same tags, vocabulary and tag dictionary; probabilities under 1e-6 are floored."""
+    with np.errstate(divide='ignore', invalid='ignore'):
+        log_prior = np.log(tag_counts / tag_counts.sum())
+        log_trans = np.maximum(np.log(bigram_counts / tag_counts[:, None]), LOG_FLOOR)
+        emit_data = np.maximum(np.log(emit_counts / tag_counts[tables.emit_indices]), LOG_FLOOR)
+
+    return HMMTables(tables.tags, tables.word_index, log_prior, np.nan_to_num(log_trans, nan=LOG_FLOOR),
+                     tables.emit_indptr, tables.emit_indices, np.nan_to_num(emit_data, nan=LOG_FLOOR),
+                     tables.oov_probabilities)
+
+
+def _shard_worker(conn, tables, shard, batch_size):
+    # Gets its own shard once; after that only the re-estimated arrays travel, each iteration
+    while True:
+        params = conn.recv()
+        if params is None:
+            break
+        tables.log_prior, tables.log_trans, tables.emit_data = params
+        tables._refresh_derived()
+        conn.send(expected_counts(shard, tables, batch_size))
+    conn.close()
+
+
+def accuracy(tables, sentences, gold):
+    predicted = viterbi_batch(sentences, tables)
+    correct = sum(p == g for ps, gs in zip(predicted, gold) for p, g in zip(ps, gs))
+    return correct / sum(len(s) for s in sentences)
+
+
+def baum_welch(tables, sentences, iterations=5, supervised_weight=1.0, workers=None, batch_size=256,
+               gold_file=None, log=print):
+    """
+    Runs EM from tables over untagged sentences; returns the final tables and one record per
+    iteration with the log-likelihood of the untagged text under the model going into that
+    iteration, the time taken and, with gold_file, the tagging accuracy on it.
+    """
+    if supervised_weight and tables.tag_counts is None:
+        raise ValueError("semi-supervised training needs the raw counts; use normalize_counts() tables or "
+                         "supervised_weight=0")
+    supervised = (0, 0, 0) if not supervised_weight else \
+        (supervised_weight * tables.tag_counts, supervised_weight * tables.bigram_counts,
+         supervised_weight * tables.emit_counts)
+    gold = read_tagged_sentences(gold_file) if gold_file else None
+    n_tokens = sum(len(s) for s in sentences)
+
+    # One process per shard, each holding only its own sentences
+    shard_workers = []
+    if workers and workers > 1:
+        shard_size = -(-len(sentences) // workers)
+        for i in range(0, len(sentences), shard_size):
+            conn, child_conn = multiprocessing.Pipe()
+            process = multiprocessing.Process(target=_shard_worker, daemon=True,
+                                              args=(child_conn, tables, sentences[i:i + shard_size], batch_size))
+            process.start()
+            child_conn.close()
+            shard_workers.append((process, conn))
+
+    history = []
+    try:
+        for iteration in range(1, iterations + 1):
+            start = time.perf_counter()
+            if shard_workers:
+                params = (tables.log_prior, tables.log_trans, tables.emit_data)
+                for _, conn in shard_workers:
+                    conn.send(params)
+                parts = [conn.recv() for _, conn in shard_workers]
+                counts = [sum(part[k] for part in parts) for k in range(4)]
+            else:
+                counts = expected_counts(sentences, tables, batch_size)
+            log_likelihood = counts[3]
+            tables = reestimate(tables, *(s + c for s, c in zip(supervised, counts[:3])))
+
+            record = {"iteration": iteration, "log_likelihood": log_likelihood,
+                      "per_token": log_likelihood / n_tokens, "seconds": time.perf_counter() - start}
+            if gold:
+                record["accuracy"] = accuracy(tables, *gold)
+            history.append(record)
+            log(f"iteration {iteration}: log-likelihood {log_likelihood:.1f} ({record['per_token']:.4f} per token), "
+                f"{record['seconds']:.2f}s" + (f", accuracy {record['accuracy']:.4f}" if gold else ""))
+    finally:
+        for process, conn in shard_workers:
+            try:
+                conn.send(None)
+            except OSError:
+                pass                            # the worker has already exited
+            conn.close()
+            process.join()
+
+    return tables, history
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Baum-Welch training of the HW3 HMM from untagged text")
+    parser.add_argument("initial", help="supervised .pos file or compiled .hmm model to start from")
+    parser.add_argument("untagged", help=".words file to train on")
+    parser.add_argument("output", help="compiled model to write")
+    parser.add_argument("--iterations", type=int, default=5)
+    parser.add_argument("--supervised-weight", type=float, default=1.0,
+                        help="weight of the supervised counts added each iteration; 0 for plain EM")
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--gold", help=".pos file to report tagging accuracy on after each iteration")
+    args = parser.parse_args()
+
+    if args.initial.endswith(".pos"):
+        tables = normalize_counts(load_training_counts(args.initial))
+    else:
+        tables = load_model(args.initial)
+    if args.gold:
+        print(f"iteration 0: accuracy {accuracy(tables, *read_tagged_sentences(args.gold)):.4f}")
+
+    tables, _ = baum_welch(tables, read_sentences(args.untagged), args.iterations, args.supervised_weight,
+                           args.workers, gold_file=args.gold)
+    save_model(tables, args.output)
+
+
+if __name__ == '__main__':
+    main()
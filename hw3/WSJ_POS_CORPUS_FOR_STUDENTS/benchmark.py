@@ -0,0 +1,165 @@
+"""
+Speed benchmark for the HW3 HMM tagger.
+
+Measures training time, compiled model load time, decoding throughput (serial and
+batched) on the input corpus and on synthetic corpora scaled up from it, per-sentence
+latency percentiles by sentence length, and peak RSS. Writes everything to a JSON
+report; given a baseline report, flags every metric that got worse by more than its
+tolerance and exits non-zero.
+
+    python benchmark.py --output bench.json
+    python benchmark.py --baseline bench.json --tolerance 0.2 --threshold decode.batch.x1.tokens_per_sec=0.1
+"""
+
+import argparse
+import json
+import os
+import random
+import resource
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from HW3 import load_training_counts, normalize_counts, read_sentences, viterbi_batch, viterbi_log
+from hmm_store import load_model, save_model
+
+LENGTH_BUCKETS = ((1, 10), (11, 20), (21, 40), (41, None))
+
+# Metrics whose value should go up; every other metric should go down
+HIGHER_IS_BETTER = ("tokens_per_sec",)
+
+
+def scaled_corpus(sentences, scale, seed=0):
+    """Synthetic corpus `scale` times the size of the input, resampled from its sentences."""
+    rng = random.Random(seed)
+    return [rng.choice(sentences) for _ in range(int(len(sentences) * scale))]
+
+
+def time_call(function, *args, repeat=1):
+    best, result = float("inf"), None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function(*args)
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def measure_throughput(sentences, tables, batch):
+    n_tokens = sum(len(s) for s in sentences)
+    if batch:
+        seconds, _ = time_call(viterbi_batch, sentences, tables)
+    else:
+        seconds, _ = time_call(lambda: [viterbi_log(s, tables) for s in sentences])
+    return {"sentences": len(sentences), "tokens": n_tokens, "seconds": seconds, "tokens_per_sec": n_tokens / seconds}
+
+
+def measure_latency(sentences, tables):
+    by_bucket = {f"{low}-{high or 'up'}": [] for low, high in LENGTH_BUCKETS}
+    for sentence in sentences:
+        start = time.perf_counter()
+        viterbi_log(sentence, tables)
+        elapsed = (time.perf_counter() - start) * 1000
+        for low, high in LENGTH_BUCKETS:
+            if len(sentence) >= low and (high is None or len(sentence) <= high):
+                by_bucket[f"{low}-{high or 'up'}"].append(elapsed)
+
+    return {bucket: {"count": len(times), **{f"p{q}_ms": float(np.percentile(times, q)) for q in (50, 90, 99)}}
+            for bucket, times in by_bucket.items() if times}
+
+
+def run_benchmark(train_file, input_file, scales=(1, 4)):
+    report = {"train_file": train_file, "input_file": input_file, "metrics": {}}
+    metrics = report["metrics"]
+
+    seconds, tables = time_call(lambda: normalize_counts(load_training_counts(train_file)))
+    metrics["train.seconds"] = seconds
+
+    with tempfile.TemporaryDirectory() as tmp:
+        model_file = os.path.join(tmp, "bench.hmm")
+        save_model(tables, model_file)
+        seconds, tables = time_call(load_model, model_file, repeat=5)
+        metrics["load.ms"] = seconds * 1000
+
+        sentences = read_sentences(input_file)
+        # Warm the emission cache so every run below sees the same steady state
+        viterbi_batch(sentences, tables)
+
+        for scale in scales:
+            corpus = sentences if scale == 1 else scaled_corpus(sentences, scale)
+            for mode in ("serial", "batch"):
+                result = measure_throughput(corpus, tables, batch=(mode == "batch"))
+                report.setdefault("throughput", {})[f"{mode}.x{scale:g}"] = result
+                metrics[f"decode.{mode}.x{scale:g}.tokens_per_sec"] = result["tokens_per_sec"]
+
+        report["latency"] = measure_latency(sentences, tables)
+        for bucket, stats in report["latency"].items():
+            for q in (50, 90, 99):
+                metrics[f"latency.{bucket}.p{q}_ms"] = stats[f"p{q}_ms"]
+
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    metrics["peak_rss_mb"] = peak / 2 ** 20 if sys.platform == "darwin" else peak / 2 ** 10
+    return report
+
+
+def find_regressions(metrics, baseline, tolerance, thresholds):
+    regressions = []
+    for name, old in baseline.items():
+        if name not in metrics or not old:
+            continue
+        allowed = thresholds.get(name, tolerance)
+        if name.endswith(HIGHER_IS_BETTER):
+            change = (old - metrics[name]) / old
+        else:
+            change = (metrics[name] - old) / old
+        if change > allowed:
+            regressions.append({"metric": name, "baseline": old, "current": metrics[name],
+                                "worse_by": change, "allowed": allowed})
+    return regressions
+
+
+def parse_thresholds(items):
+    thresholds = {}
+    for item in items:
+        name, _, value = item.partition("=")
+        thresholds[name] = float(value)
+    return thresholds
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Speed benchmark for the HW3 HMM tagger")
+    parser.add_argument("--train", default="WSJ_24.pos")
+    parser.add_argument("--input", default="WSJ_24.words")
+    parser.add_argument("--scales", default="1,4", help="comma separated corpus scale factors")
+    parser.add_argument("--output", default="bench.json")
+    parser.add_argument("--baseline", help="earlier report to check for regressions")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed relative slowdown per metric")
+    parser.add_argument("--threshold", action="append", default=[], metavar="METRIC=TOLERANCE",
+                        help="per-metric override of --tolerance")
+    args = parser.parse_args()
+
+    report = run_benchmark(args.train, args.input, [float(s) for s in args.scales.split(",")])
+
+    status = 0
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)["metrics"]
+        report["regressions"] = find_regressions(report["metrics"], baseline, args.tolerance,
+                                                 parse_thresholds(args.threshold))
+        status = 1 if report["regressions"] else 0
+
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+
+    for name, value in report["metrics"].items():
+        print(f"{name:<40}{value:>14.3f}")
+    for regression in report.get("regressions", []):
+        print(f"REGRESSION {regression['metric']}: {regression['baseline']:.3f} -> {regression['current']:.3f} "
+              f"({regression['worse_by']:.0%} worse, {regression['allowed']:.0%} allowed)")
+    return status
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,164 @@
+"""
+Compiled HMM model file for the HW3 tagger.
+
+Layout: 8 byte magic, 8 byte little-endian header length, a JSON header,
+then every array as raw bytes aligned to 64 bytes. The header records the
+dtype, shape and offset of each array, so load_model() can map them straight
+out of the file without parsing or copying anything.
+"""
+
+import json
+import multiprocessing
+import os
+import sys
+from contextlib import ExitStack
+
+import numpy as np
+
+from HW3 import (HMMTables, normalize_counts, read_sentences, read_tagged_sentences, tag_confidences, tag_corpus,
+                 tag_stream, train_counts, write_tagged)
+from tag_cache import SentenceCache
+
+
+MAGIC = b"HMMTAGR1"
+FORMAT_VERSION = 1
+ALIGNMENT = 64
+
+
+def _align(offset):
+    return (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+def save_model(tables, path):
+    vocab = sorted(tables.word_index, key=tables.word_index.get)
+    arrays = {
+        "log_prior": tables.log_prior,
+        "log_trans": tables.log_trans,
+        "emit_indptr": tables.emit_indptr,
+        "emit_indices": tables.emit_indices,
+        "emit_data": tables.emit_data,
+        "oov_probs": np.array([tables.oov_probabilities.get(tag, 0.0) for tag in tables.tags]),
+        "vocab": np.frombuffer("\n".join(vocab).encode("utf-8"), dtype=np.uint8),
+    }
+    if tables.tag_counts is not None:
+        # Raw counts let HMMTables.update() work on the loaded model without the training corpus
+        arrays.update(tag_counts=tables.tag_counts, bigram_counts=tables.bigram_counts, emit_counts=tables.emit_counts)
+
+    layout = {}
+    offset = 0
+    for name, array in arrays.items():
+        array = np.ascontiguousarray(array)
+        arrays[name] = array
+        layout[name] = {"dtype": array.dtype.str, "shape": list(array.shape), "offset": offset}
+        offset = _align(offset + array.nbytes)
+
+    header = json.dumps({"version": FORMAT_VERSION, "tags": tables.tags, "arrays": layout}).encode("utf-8")
+    data_start = _align(len(MAGIC) + 8 + len(header))
+
+    # Write beside the target and rename over it, so processes still mapping the old file are unaffected
+    tmp_path = f"{path}.tmp{os.getpid()}"
+    with open(tmp_path, "wb") as f:
+        f.write(MAGIC)
+        f.write(len(header).to_bytes(8, "little"))
+        f.write(header)
+        for name, array in arrays.items():
+            f.seek(data_start + layout[name]["offset"])
+            f.write(array.tobytes())
+        f.truncate(data_start + offset)
+    os.replace(tmp_path, path)
+
+
+def load_model(path):
+    with open(path, "rb") as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{path} is not a compiled HMM model")
+        header_len = int.from_bytes(f.read(8), "little")
+        header = json.loads(f.read(header_len).decode("utf-8"))
+
+    if header["version"] != FORMAT_VERSION:
+        raise ValueError(f"{path} has model format version {header['version']}, expected {FORMAT_VERSION}")
+
+    # One read-only mapping for the whole file; every array is a view into it
+    buffer = np.memmap(path, dtype=np.uint8, mode="r")
+    data_start = _align(len(MAGIC) + 8 + header_len)
+    arrays = {}
+    for name, spec in header["arrays"].items():
+        arrays[name] = np.ndarray(tuple(spec["shape"]), dtype=np.dtype(spec["dtype"]), buffer=buffer,
+                                  offset=data_start + spec["offset"])
+
+    tags = header["tags"]
+    vocab = arrays["vocab"].tobytes().decode("utf-8").split("\n")
+    word_index = {word: i for i, word in enumerate(vocab)}
+    oov_probabilities = {tag: float(p) for tag, p in zip(tags, arrays["oov_probs"])}
+
+    counts = None
+    if "tag_counts" in arrays:
+        counts = (arrays["tag_counts"], arrays["bigram_counts"], arrays["emit_counts"])
+
+    return HMMTables(tags, word_index, arrays["log_prior"], arrays["log_trans"], arrays["emit_indptr"],
+                     arrays["emit_indices"], arrays["emit_data"], oov_probabilities, model_file=path, counts=counts)
+
+
+def compile_model(input_training_data, model_file, workers=None):
+    # input_training_data is one .pos file, a glob, or a list of them
+    tables = normalize_counts(train_counts(input_training_data, workers))
+    save_model(tables, model_file)
+    print(f"Compiled {input_training_data} into {model_file} ({len(tables.tags)} tags, {len(tables.word_index)} words)")
+    return tables
+
+
+def update_model(model_file, corrections_file, output_file=None):
+    tables = load_model(model_file)
+    sentences, gold = read_tagged_sentences(corrections_file)
+    tables.update([list(zip(words, tags)) for words, tags in zip(sentences, gold)])
+    save_model(tables, output_file or model_file)
+    print(f"Updated {model_file} with {len(sentences)} sentences from {corrections_file}")
+    return tables
+
+
+def write_confidences(model_file, input_file, output_file):
+    # word, most probable tag and its posterior probability, one token per line
+    sentences = read_sentences(input_file)
+    with open(output_file, 'w') as fout:
+        for sentence, scored in zip(sentences, tag_confidences(sentences, load_model(model_file))):
+            for word, (tag, probability) in zip(sentence, scored):
+                fout.write(f"{word}\t{tag}\t{probability:.4f}\n")
+            fout.write("\n")
+
+
+def main(args):
+    if len(args) >= 4 and args[1] == "compile":
+        compile_model(args[2:-1], args[-1], workers=multiprocessing.cpu_count())
+    elif len(args) in (4, 5) and args[1] == "update":
+        update_model(*args[2:])
+    elif len(args) in (5, 6) and args[1] == "tag":
+        # An optional sixth argument is a sentence cache file, reused and updated across runs
+        cache = SentenceCache(path=args[5]) if len(args) == 6 else None
+        tables = load_model(args[2])
+        if "-" in args[3:5]:
+            # Streaming mode: "-" reads tokens from stdin and/or writes tags to stdout as sentences end
+            with ExitStack() as stack:
+                # Only the files opened here are closed; stdin and stdout are left alone
+                fin = sys.stdin if args[3] == "-" else stack.enter_context(open(args[3], 'r'))
+                fout = sys.stdout if args[4] == "-" else stack.enter_context(open(args[4], 'w'))
+                write_tagged(fout, tag_stream(fin, tables, cache=cache), buffer_sentences=1 if fin.isatty() else 256)
+        else:
+            tag_corpus(args[3], args[4], tables, cache=cache)
+            print(f"Tagging complete! Output saved to {args[4]}")
+        if cache is not None:
+            cache.save()
+            info = cache.info()
+            print(f"Sentence cache: {info['hits']} hits, {info['misses']} misses ({info['hit_rate']:.1%}), "
+                  f"{info['size']} entries in {args[5]}", file=sys.stderr)
+    elif len(args) == 5 and args[1] == "confidence":
+        write_confidences(*args[2:])
+    else:
+        print("usage: hmm_store.py compile <training.pos or glob>... <model.hmm>\n"
+              "       hmm_store.py update <model.hmm> <corrections.pos> [<updated.hmm>]\n"
+              "       hmm_store.py tag <model.hmm> <input.words or -> <output.pos or -> [<cache file>]\n"
+              "       hmm_store.py confidence <model.hmm> <input.words> <output.conf>")
+        return 1
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
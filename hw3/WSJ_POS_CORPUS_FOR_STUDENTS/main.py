@@ -57,31 +57,31 @@ def viterbi(words, prior_probs, transition_probs, likelihood_probs, vocab):
     n = len(words)
     m = len(tags)
 
-    dp = np.zeros((m, n))
-    backpointer = np.zeros((m, n), dtype=int)
+    # Log-space tables so each step is a single broadcasted max/argmax
+    log_prior = np.log([prior_probs.get(tag, 1e-6) for tag in tags])
+    log_trans = np.log([[transition_probs.get(prev_tag, {}).get(curr_tag, 1e-6) for curr_tag in tags]
+                        for prev_tag in tags])
+    log_emit = np.log([[likelihood_probs.get(tag, {}).get(word, 1e-6) for tag in tags] for word in words])
+
+    backpointer = np.zeros((n, m), dtype=int)
 
     # Initialization step
-    for i, tag in enumerate(tags):
-        dp[i, 0] = prior_probs.get(tag, 1e-6) * likelihood_probs.get(tag, {}).get(words[0], 1e-6)
+    score = log_prior + log_emit[0]
 
-    # Recursion step
+    # Recursion step: candidates[j, i] is the score of tag i at t reached from tag j at t - 1
     for t in range(1, n):
-        for i, curr_tag in enumerate(tags):
-            max_prob, max_state = max(
-                (dp[j, t - 1] * transition_probs.get(prev_tag, {}).get(curr_tag, 1e-6) *
-                 likelihood_probs.get(curr_tag, {}).get(words[t], 1e-6), j)
-                for j, prev_tag in enumerate(tags)
-            )
-            dp[i, t] = max_prob
-            backpointer[i, t] = max_state
+        candidates = score[:, None] + log_trans
+        best_prev = m - 1 - np.argmax(candidates[::-1], axis=0)  # ties go to the last j, as before
+        backpointer[t] = best_prev
+        score = candidates[best_prev, np.arange(m)] + log_emit[t]
 
     # Backtracking step
     best_path = []
-    best_last_tag = np.argmax(dp[:, -1])
+    best_last_tag = np.argmax(score)
     best_path.append(tags[best_last_tag])
 
     for t in range(n - 1, 0, -1):
-        best_last_tag = backpointer[best_last_tag, t]
+        best_last_tag = backpointer[t, best_last_tag]
         best_path.append(tags[best_last_tag])
 
     return list(reversed(best_path))
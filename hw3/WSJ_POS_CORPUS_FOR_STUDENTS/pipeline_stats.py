@@ -0,0 +1,80 @@
+"""
+Stage timers, counters and histograms for the HW3 tagging pipeline.
+
+Pass a PipelineStats to final_call(), load_training_counts() or tag_corpus() to find
+out where the time goes (load, count, normalize, read, decode, write) and what the
+input looked like (OOV rate, 1e-6 fallback hits, sentence lengths). Read the totals
+with report() / write_json(), or subscribe() a callback to get every event as it
+happens.
+"""
+
+import json
+import time
+from contextlib import contextmanager, nullcontext
+
+
+class PipelineStats:
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self.stages = {}                    # name -> {"seconds": float, "calls": int}
+        self.counters = {}                  # name -> int
+        self.histograms = {}                # name -> {value: count}
+        self.callbacks = []
+
+    def subscribe(self, callback):
+        """callback(kind, name, value) is called for every "stage", "count" and "observe" event."""
+        self.callbacks.append(callback)
+
+    def _emit(self, kind, name, value):
+        for callback in self.callbacks:
+            callback(kind, name, value)
+
+    @contextmanager
+    def _timed(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            stage = self.stages.setdefault(name, {"seconds": 0.0, "calls": 0})
+            stage["seconds"] += elapsed
+            stage["calls"] += 1
+            self._emit("stage", name, elapsed)
+
+    def stage(self, name):
+        return self._timed(name) if self.enabled else nullcontext()
+
+    def count(self, name, n=1):
+        if self.enabled:
+            self.counters[name] = self.counters.get(name, 0) + n
+            self._emit("count", name, n)
+
+    def observe(self, name, value):
+        if self.enabled:
+            histogram = self.histograms.setdefault(name, {})
+            histogram[value] = histogram.get(value, 0) + 1
+            self._emit("observe", name, value)
+
+    def report(self):
+        counters = self.counters
+        derived = {}
+        if counters.get("tokens"):
+            derived["oov_rate"] = counters.get("oov_tokens", 0) / counters["tokens"]
+            derived["emission_fallbacks_per_token"] = counters.get("emission_fallbacks", 0) / counters["tokens"]
+        lookups = counters.get("sentence_cache_hits", 0) + counters.get("sentence_cache_misses", 0)
+        if lookups:
+            derived["sentence_cache_hit_rate"] = counters.get("sentence_cache_hits", 0) / lookups
+        decode = self.stages.get("decode")
+        if decode and decode["seconds"] and counters.get("tokens"):
+            derived["decode_tokens_per_sec"] = counters["tokens"] / decode["seconds"]
+
+        return {"stages": self.stages, "counters": counters, "derived": derived,
+                "histograms": {name: dict(sorted(h.items())) for name, h in self.histograms.items()}}
+
+    def write_json(self, path):
+        with open(path, "w") as f:
+            json.dump(self.report(), f, indent=2)
+
+
+# Shared do-nothing instance for callers that did not ask for statistics
+NO_STATS = PipelineStats(enabled=False)
@@ -1,63 +1,60 @@
-import re
-import itertools
-
-
-def open_files():
-    with open("./WSJ_24_sys.pos", 'r') as file:
-        content = file.read()
-    return content
-
-
-# Read training data
-list_training = open_files().split()
-list_tags = list_training[1::2]  # Extract tags
-set_tags = set(list_tags)  # Get unique tags
-
-# Extract words (tokens) from training data
-list_words_training = [item for item in list_training if item not in list_tags]
-
-# Clean the set_tags by removing single alphabetic characters
-pattern = r'\b[A-Za-z]\b'
-cleaned_tags = {tag for tag in set_tags if not re.match(pattern, tag)}
-set_tags = cleaned_tags  # Update set_tags
-
-print(len(set_tags))
-
-
-def prior_p(list_words, list_tags, set_tags):
-    """Computes prior probabilities of tags."""
-    dict_tags = {tag: 0 for tag in set_tags}  # Initialize dictionary
-    tracking = 0
-
-    for i in range(len(list_words)):
-        if list_words[i] == "." or i < len(list_words) - 1:
-            if list_tags[i + 1] in dict_tags:
-                dict_tags[list_tags[i + 1]] += 1
-                tracking += 1
-
-    # Convert counts to probabilities
-    for tag in dict_tags:
-        dict_tags[tag] /= tracking if tracking > 0 else 1
-
-    return dict_tags
-
-
-def transition_probabilities(set_tags, list_tags, current_term, previous_term):
-    """Computes transition probabilities between tags."""
-    transition_dict = {pair: 0 for pair in itertools.product(set_tags, set_tags)}
-    bigrams_tags = [(list_tags[i], list_tags[i + 1]) for i in range(len(list_tags) - 1)]
-
-    # Count occurrences of tag bigrams
-    for bigram in bigrams_tags:
-        if bigram in transition_dict:
-            transition_dict[bigram] += 1
-
-    # Convert counts to probabilities
-    for pair in transition_dict:
-        transition_dict[pair] /= (2 * len(list_tags)) if len(list_tags) > 0 else 1
-
-    return transition_dict.get((current_term, previous_term), 0)
-
-
-# Print prior probabilities
-print(prior_p(list_words_training, list_tags, set_tags))
+import sys
+import time
+
+import numpy as np
+
+from HW3 import count_arrays, read_training_ids
+
+
+class CorpusStats:
+    """
+    Tag statistics of a word/tag file, counted in one pass over it. prior() and transition()
+    are a dict lookup and an array index, and the whole tables can be exported at once.
+    """
+
+    def __init__(self, words, tags, word_counts, tag_counts, bigram_counts):
+        self.words = words                  # word strings, in first-seen order
+        self.tags = tags                    # tag strings, in first-seen order
+        self.tag_index = {tag: i for i, tag in enumerate(tags)}
+        self.word_counts = word_counts      # (n_words,) C(word)
+        self.tag_counts = tag_counts        # (m,)       C(tag)
+        self.bigram_counts = bigram_counts  # (m, m)     C(prev, cur) within a sentence
+
+        self.prior_vector = tag_counts / tag_counts.sum()
+        with np.errstate(divide='ignore', invalid='ignore'):
+            self.transition_matrix = np.nan_to_num(bigram_counts / tag_counts[:, None])
+        # Plain Python copies, so single lookups skip NumPy scalar overhead
+        self._prior = dict(zip(tags, self.prior_vector.tolist()))
+        self._transition = self.transition_matrix.tolist()
+
+    @classmethod
+    def from_file(cls, path):
+        words, tags, word_ids, tag_ids = read_training_ids(path)
+        tag_counts, bigram_counts, emit_words, _, emit_counts = count_arrays(word_ids, tag_ids, len(words), len(tags))
+        word_counts = np.bincount(emit_words, weights=emit_counts, minlength=len(words)).astype(np.int64)
+        return cls(words, tags, word_counts, tag_counts, bigram_counts)
+
+    def prior(self, tag):
+        """P(tag): the share of tokens with this tag; 0 for a tag never seen."""
+        return self._prior.get(tag, 0.0)
+
+    def transition(self, prev, cur):
+        """P(cur | prev) over adjacent tags within a sentence; 0 if prev or cur was never seen."""
+        i, j = self.tag_index.get(prev), self.tag_index.get(cur)
+        if i is None or j is None:
+            return 0.0
+        return self._transition[i][j]
+
+    def export(self, path):
+        """Writes tags, counts, prior vector and transition matrix to one .npz file."""
+        np.savez(path, tags=np.array(self.tags), tag_counts=self.tag_counts, bigram_counts=self.bigram_counts,
+                 prior=self.prior_vector, transition=self.transition_matrix)
+
+
+if __name__ == "__main__":
+    path = sys.argv[1] if len(sys.argv) > 1 else "./WSJ_24_sys.pos"
+    start = time.perf_counter()
+    stats = CorpusStats.from_file(path)
+    print(f"{len(stats.tags)} tags, {len(stats.words)} words, {int(stats.tag_counts.sum())} tokens "
+          f"counted in {time.perf_counter() - start:.3f}s")
+    print({tag: round(stats.prior(tag), 5) for tag in sorted(stats.tags)})
@@ -0,0 +1,161 @@
+"""
+Smoothing and OOV hyperparameter sweep for the HW3 HMM tagger.
+
+The training counts are built once. Each pool worker receives them, together with the dev
+set, once at start-up and only reads them; a configuration is then just a cheap
+renormalization of those counts plus one batched decode of the dev set, all in memory.
+
+Swept settings:
+    trans_floor  probability of a transition never seen in training (1e-6 in HW3.py)
+    emit_floor   probability of a (word, tag) pair never seen in training (1e-6 in HW3.py)
+    add_k        add-k smoothing of the transition counts before the floor applies
+    oov          "borrow"    an OOV word borrows the emission row of its guessed tag string, as viterbi() does
+                 "hapax"     P(unknown | tag) from the words seen once, the same for every OOV word
+                 "signature" the same, but counted separately per OOV signature (suffix, digit, ...)
+
+    python sweep.py WSJ_24.pos --dev-fraction 0.25 --workers 4 --output sweep.json
+"""
+
+import argparse
+import itertools
+import json
+import multiprocessing
+import time
+from array import array
+
+import numpy as np
+
+from HW3 import (HMMCounts, HMMTables, count_arrays, load_training_counts, normalize_counts, oov_signature,
+                 read_tagged_sentences, signature_tags, viterbi_batch)
+
+GRID = {
+    "trans_floor": (1e-6, 1e-8, 1e-4),
+    "emit_floor": (1e-6, 1e-8, 1e-10),
+    "add_k": (0.0, 0.01),
+    "oov": ("borrow", "hapax", "signature"),
+}
+
+
+def counts_from_sentences(sentences, gold):
+    """HMMCounts of in-memory tagged sentences, the same as load_training_counts() on their .pos file."""
+    word_index, tag_index = {}, {}
+    word_ids, tag_ids = array('i'), array('i')
+    for words, tags in zip(sentences, gold):
+        for word, tag in zip(words, tags):
+            word_ids.append(word_index.setdefault(word, len(word_index)))
+            tag_ids.append(tag_index.setdefault(tag, len(tag_index)))
+        word_ids.append(-1)
+        tag_ids.append(-1)
+    return HMMCounts(list(tag_index), list(word_index),
+                     *count_arrays(word_ids, tag_ids, len(word_index), len(tag_index)))
+
+
+def hapax_by_signature(counts):
+    """(signatures, (n_signatures, m) counts of the words seen once, by their OOV signature and tag)."""
+    word_counts = np.bincount(counts.emit_words, weights=counts.emit_counts, minlength=len(counts.words))
+    hapax = np.flatnonzero(word_counts[counts.emit_words] == 1)
+    signatures = list(signature_tags({}))
+    row = {signature: i for i, signature in enumerate(signatures)}
+    table = np.zeros((len(signatures), len(counts.tags)))
+    sig_rows = [row[oov_signature(counts.words[w])] for w in counts.emit_words[hapax]]
+    np.add.at(table, (sig_rows, counts.emit_tags[hapax]), 1)
+    return signatures, table
+
+
+def configure(base, counts, hapax, trans_floor, emit_floor, add_k, oov):
+    """Tables for one configuration: base's vocabulary and emissions, renormalized transitions and OOV rows."""
+    m = len(base.tags)
+    log_floor = np.log(emit_floor)
+    bigram = counts.bigram_counts + add_k
+    with np.errstate(divide='ignore'):
+        log_trans = np.log(bigram / (counts.tag_counts[:, None] + add_k * m))
+    # Unseen transitions (log 0) and any smoothed estimate below the floor get the floor
+    log_trans = np.maximum(log_trans, np.log(trans_floor))
+
+    oov_vectors = None
+    if oov != "borrow":
+        signatures, table = hapax
+        if oov == "hapax":
+            table = np.broadcast_to(table.sum(axis=0), table.shape)
+        with np.errstate(divide='ignore'):
+            vectors = np.maximum(np.log(table / counts.tag_counts), log_floor)
+        oov_vectors = dict(zip(signatures, vectors))
+
+    return HMMTables(base.tags, base.word_index, base.log_prior, log_trans, base.emit_indptr, base.emit_indices,
+                     base.emit_data, base.oov_probabilities, log_floor=log_floor, oov_vectors=oov_vectors)
+
+
+_shared = None
+
+
+def _init_worker(counts, dev):
+    # Everything a worker needs, received once; the base tables are built here from the shared counts
+    global _shared
+    signatures_table = hapax_by_signature(counts)
+    _shared = (counts, normalize_counts(counts), signatures_table, dev)
+
+
+def evaluate(config):
+    counts, base, hapax, (sentences, gold) = _shared
+    start = time.perf_counter()
+    tables = configure(base, counts, hapax, **config)
+    predicted = viterbi_batch(sentences, tables)
+    elapsed = time.perf_counter() - start
+
+    n_tokens = correct = oov_tokens = oov_correct = 0
+    for words, ps, gs in zip(sentences, predicted, gold):
+        for word, p, g in zip(words, ps, gs):
+            n_tokens += 1
+            correct += p == g
+            if word not in tables.word_index:
+                oov_tokens += 1
+                oov_correct += p == g
+    return {**config, "accuracy": correct / n_tokens, "oov_accuracy": oov_correct / oov_tokens if oov_tokens else None,
+            "seconds": elapsed}
+
+
+def sweep(counts, dev, grid=GRID, workers=None):
+    configs = [dict(zip(grid, values)) for values in itertools.product(*grid.values())]
+    if workers and workers > 1:
+        with multiprocessing.Pool(workers, initializer=_init_worker, initargs=(counts, dev)) as pool:
+            return pool.map(evaluate, configs)
+    _init_worker(counts, dev)
+    return [evaluate(config) for config in configs]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Smoothing and OOV sweep for the HW3 HMM tagger")
+    parser.add_argument("train", help="tagged .pos training file")
+    parser.add_argument("--dev", help="tagged .pos dev file; without it the last --dev-fraction of train is held out")
+    parser.add_argument("--dev-fraction", type=float, default=0.25)
+    parser.add_argument("--workers", type=int, default=multiprocessing.cpu_count())
+    parser.add_argument("--output", help="write every result to this JSON file")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    if args.dev:
+        counts, dev = load_training_counts(args.train), read_tagged_sentences(args.dev)
+    else:
+        sentences, gold = read_tagged_sentences(args.train)
+        cut = int(len(sentences) * (1 - args.dev_fraction))
+        counts, dev = counts_from_sentences(sentences[:cut], gold[:cut]), (sentences[cut:], gold[cut:])
+    print(f"counted {int(counts.tag_counts.sum())} training tokens in {time.perf_counter() - start:.2f}s; "
+          f"dev set {sum(len(s) for s in dev[0])} tokens")
+
+    start = time.perf_counter()
+    results = sweep(counts, dev, workers=args.workers)
+    print(f"{len(results)} configurations in {time.perf_counter() - start:.2f}s\n")
+
+    print(f"{'trans_floor':>12}{'emit_floor':>12}{'add_k':>8}{'oov':>11}{'accuracy':>10}{'oov acc':>9}{'seconds':>9}")
+    for row in sorted(results, key=lambda r: -r["accuracy"]):
+        oov_accuracy = f"{row['oov_accuracy']:.4f}" if row["oov_accuracy"] is not None else "-"
+        print(f"{row['trans_floor']:>12g}{row['emit_floor']:>12g}{row['add_k']:>8g}{row['oov']:>11}"
+              f"{row['accuracy']:>10.4f}{oov_accuracy:>9}{row['seconds']:>9.3f}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,64 @@
+"""
+Sentence-level cache of tagging results for the HW3 tagger.
+
+News text repeats whole sentences (datelines, bylines, disclaimers), and decoding one of
+them again gives the same tags. SentenceCache is a bounded LRU from (model key, tokens)
+to tags; the model key holds the model's fingerprint and the decoding options, so entries
+from an older model or another decoder are never served. It can be saved to disk and
+loaded again by the next run.
+"""
+
+import os
+import pickle
+from collections import OrderedDict
+
+FORMAT_VERSION = 1
+
+
+class SentenceCache:
+    def __init__(self, maxsize=100000, path=None):
+        self.maxsize = maxsize
+        self.path = path                    # loaded from here if it exists, and saved back by save()
+        self.entries = OrderedDict()        # (model key, tokens) -> tags, least recently used first
+        self.hits = 0
+        self.misses = 0
+        if path and os.path.exists(path):
+            self.load(path)
+
+    def get(self, key):
+        tags = self.entries.get(key)
+        if tags is None:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return tags
+
+    def put(self, key, tags):
+        self.entries[key] = tuple(tags)
+        self.entries.move_to_end(key)
+        if len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+
+    def info(self):
+        lookups = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses, "size": len(self.entries), "maxsize": self.maxsize,
+                "hit_rate": self.hits / lookups if lookups else 0.0}
+
+    def load(self, path):
+        with open(path, "rb") as f:
+            data = pickle.load(f)
+        if data.get("version") != FORMAT_VERSION:
+            raise ValueError(f"{path} has cache format version {data.get('version')}, expected {FORMAT_VERSION}")
+        # Oldest first, so the most recently used entries survive a smaller maxsize
+        for key, tags in data["entries"][-self.maxsize:]:
+            self.entries[key] = tags
+
+    def save(self, path=None):
+        path = path or self.path
+        # Written beside the target and renamed over it, like compiled models
+        tmp_path = f"{path}.tmp{os.getpid()}"
+        with open(tmp_path, "wb") as f:
+            pickle.dump({"version": FORMAT_VERSION, "entries": list(self.entries.items())}, f,
+                        protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
@@ -0,0 +1,82 @@
+"""
+Load generator for tag_server.py.
+
+Replays the sentences of a .words file against a running server, one sentence per
+request, from several concurrent keep-alive clients, then prints throughput and
+latency percentiles. With --model it starts the server in-process first.
+
+    python tag_loadgen.py WSJ_24.words --url http://127.0.0.1:8469 --clients 16
+    python tag_loadgen.py WSJ_24.words --model wsj.hmm --clients 16
+"""
+
+import argparse
+import http.client
+import json
+import threading
+import time
+from urllib.parse import urlparse
+
+import numpy as np
+
+from HW3 import read_sentences
+
+
+def run_client(host, port, sentences, latencies):
+    connection = http.client.HTTPConnection(host, port)
+    for sentence in sentences:
+        # bytes, so http.client sends headers and body in one packet
+        body = json.dumps({"sentences": [sentence]}).encode("utf-8")
+        start = time.perf_counter()
+        connection.request("POST", "/tag", body, {"Content-Type": "application/json"})
+        response = connection.getresponse()
+        response.read()
+        latencies.append(time.perf_counter() - start)
+        if response.status != 200:
+            raise RuntimeError(f"server answered {response.status}")
+    connection.close()
+
+
+def run_load(url, sentences, clients):
+    target = urlparse(url)
+    shares = [sentences[i::clients] for i in range(clients)]
+    latencies = [[] for _ in range(clients)]
+    threads = [threading.Thread(target=run_client, args=(target.hostname, target.port, share, lat))
+               for share, lat in zip(shares, latencies)]
+
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    latencies = np.array([x for lat in latencies for x in lat]) * 1000
+    n_tokens = sum(len(s) for s in sentences)
+    return {"clients": clients, "sentences": len(sentences), "seconds": elapsed,
+            "sentences_per_sec": len(sentences) / elapsed, "tokens_per_sec": n_tokens / elapsed,
+            "latency_ms": {f"p{q}": float(np.percentile(latencies, q)) for q in (50, 90, 99)}}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test for tag_server.py")
+    parser.add_argument("words_file")
+    parser.add_argument("--url", default="http://127.0.0.1:8469")
+    parser.add_argument("--clients", type=int, default=8)
+    parser.add_argument("--model", help="start a server on this compiled model before the run")
+    args = parser.parse_args()
+
+    if args.model:
+        from hmm_store import load_model
+        from tag_server import make_server
+        server = make_server(load_model(args.model), urlparse(args.url).port)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    report = run_load(args.url, read_sentences(args.words_file), args.clients)
+    if args.model:
+        report["server"] = server.RequestHandlerClass.batcher.stats()
+        server.shutdown()
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,170 @@
+"""
+Long-running tagging service for the HW3 HMM tagger.
+
+Loads a compiled model once and serves it over localhost HTTP:
+
+    POST /tag    {"sentences": [["The", "economy", ...], ...]}  ->  {"tags": [["DT", "NN", ...], ...]}
+    GET  /stats  request, batch and emission cache counters
+
+Concurrent requests are micro-batched: a single decoder thread collects whatever
+sentences arrive within a short window (or until the batch is full) and decodes
+them together with viterbi_batch().
+
+    python tag_server.py wsj.hmm [port]
+"""
+
+import json
+import queue
+import sys
+import threading
+import time
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from HW3 import viterbi_batch
+from hmm_store import load_model
+
+DEFAULT_PORT = 8469
+
+
+class MicroBatcher:
+    def __init__(self, tables, max_batch=128, max_wait=0.002):
+        self.tables = tables
+        self.max_batch = max_batch          # sentences per decoding pass
+        self.max_wait = max_wait            # seconds to wait for more work once a request is queued
+        self.pending = queue.Queue()
+        self.requests = 0
+        self.sentences = 0
+        self.batches = 0
+        self.decode_seconds = 0.0
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def submit(self, sentences):
+        future = Future()
+        self.pending.put((sentences, future))
+        return future
+
+    def _collect(self):
+        batch = [self.pending.get()]
+        size = len(batch[0][0])
+        deadline = time.perf_counter() + self.max_wait
+        while size < self.max_batch:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                item = self.pending.get(timeout=remaining)
+            except queue.Empty:
+                break
+            batch.append(item)
+            size += len(item[0])
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            sentences = [sentence for request, _ in batch for sentence in request]
+            start = time.perf_counter()
+            try:
+                tags = viterbi_batch(sentences, self.tables)
+            except Exception:
+                # One bad request must not fail the others: decode each request on its own
+                self._run_separately(batch)
+                continue
+            self.decode_seconds += time.perf_counter() - start
+            self.requests += len(batch)
+            self.sentences += len(sentences)
+            self.batches += 1
+
+            # Hand each request back its own slice of the batch
+            offset = 0
+            for request, future in batch:
+                future.set_result(tags[offset:offset + len(request)])
+                offset += len(request)
+
+    def _run_separately(self, batch):
+        for request, future in batch:
+            start = time.perf_counter()
+            try:
+                tags = viterbi_batch(request, self.tables)
+            except Exception as error:
+                future.set_exception(error)
+                continue
+            self.decode_seconds += time.perf_counter() - start
+            self.requests += 1
+            self.sentences += len(request)
+            self.batches += 1
+            future.set_result(tags)
+
+    def stats(self):
+        return {"requests": self.requests, "sentences": self.sentences, "batches": self.batches,
+                "mean_batch_sentences": self.sentences / self.batches if self.batches else 0.0,
+                "decode_seconds": self.decode_seconds, "emission_cache": self.tables.emission_cache_info()}
+
+
+class TaggingHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"           # keep-alive, so load generators can reuse connections
+    disable_nagle_algorithm = True          # headers and body go out in separate writes
+    batcher = None
+
+    def _reply(self, status, body):
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path == "/stats":
+            self._reply(200, self.batcher.stats())
+        else:
+            self._reply(404, {"error": "not found"})
+
+    def do_POST(self):
+        if self.path != "/tag":
+            self._reply(404, {"error": "not found"})
+            return
+        try:
+            request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+            sentences = request.get("sentences") if isinstance(request, dict) else None
+            if not isinstance(sentences, list) or not all(
+                    isinstance(s, list) and all(isinstance(w, str) and w for w in s) for s in sentences):
+                raise ValueError("sentences must be lists of non-empty token strings")
+        except ValueError as error:
+            self._reply(400, {"error": str(error)})
+            return
+        try:
+            tags = self.batcher.submit(sentences).result()
+        except Exception as error:
+            self._reply(500, {"error": f"{type(error).__name__}: {error}"})
+            return
+        self._reply(200, {"tags": tags})
+
+    def log_message(self, format, *args):
+        pass
+
+
+def make_server(tables, port=DEFAULT_PORT, host="127.0.0.1", **batch_options):
+    handler = type("Handler", (TaggingHandler,), {"batcher": MicroBatcher(tables, **batch_options)})
+    return ThreadingHTTPServer((host, port), handler)
+
+
+def main(args):
+    if len(args) not in (2, 3):
+        print("usage: tag_server.py <model.hmm> [port]")
+        return 1
+    port = int(args[2]) if len(args) == 3 else DEFAULT_PORT
+    server = make_server(load_model(args[1]), port)
+    print(f"Tagging on http://127.0.0.1:{port}/tag")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -0,0 +1,179 @@
+"""
+Second-order (trigram) HMM tagging mode for HW3.
+
+P(cur | prev2, prev) is a linear interpolation of the trigram, bigram and unigram relative
+frequencies, with weights set by deleted interpolation (Brants, TnT). The emission tables,
+OOV handling and prior are the bigram model's.
+
+The decoder runs over (prev, cur) tag pair states, which squares the state space. It is
+kept small by the tag dictionary (a known word may only take the tags it was seen with)
+and an optional beam over the pair states. Without either it is exact trigram Viterbi.
+
+    python trigram.py [train.pos] [gold.pos]     # accuracy and speed against the bigram decoder
+"""
+
+import sys
+import time
+
+import numpy as np
+
+from HW3 import (HMMCounts, count_arrays, normalize_counts, read_tagged_sentences, read_training_ids,
+                 viterbi_batch, viterbi_log, viterbi_pruned)
+
+
+class TrigramTables:
+    def __init__(self, tables, log_trans2, log_trans3, lambdas):
+        self.tables = tables                # bigram HMMTables: tags, prior, emissions, tag dictionary
+        self.log_trans2 = log_trans2        # (m, m)    log P(cur | prev), interpolated, for the second word
+        self.log_trans3 = log_trans3        # (m, m, m) log P(cur | prev2, prev), interpolated
+        self.lambdas = lambdas              # (unigram, bigram, trigram) weights
+
+
+def deleted_interpolation(trigram_counts, bigram_counts, tag_counts):
+    """
+    Weights for the unigram, bigram and trigram estimates. Each trigram votes with its count
+    for the estimate that predicts it best once that one occurrence is left out.
+    """
+    a, b, c = np.nonzero(trigram_counts)
+    f = trigram_counts[a, b, c]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        estimates = np.stack([
+            (tag_counts[c] - 1) / (tag_counts.sum() - 1),
+            np.nan_to_num((bigram_counts[b, c] - 1) / (tag_counts[b] - 1)),
+            np.nan_to_num((f - 1) / (bigram_counts[a, b] - 1)),
+        ])
+    # Ties go to the higher order, as argmax over the reversed rows picks the last maximum
+    winner = 2 - np.argmax(estimates[::-1], axis=0)
+    weights = np.bincount(winner, weights=f, minlength=3)
+    return weights / weights.sum()
+
+
+def build_trigram_tables(file_path):
+    words, tags, word_ids, tag_ids = read_training_ids(file_path)
+    m = len(tags)
+    tag_counts, bigram_counts, emit_words, emit_tags, emit_counts = count_arrays(word_ids, tag_ids, len(words), m)
+    tables = normalize_counts(HMMCounts(tags, words, tag_counts, bigram_counts, emit_words, emit_tags, emit_counts))
+
+    # A trigram is any three adjacent tokens with no sentence break among them
+    tag_ids = np.asarray(tag_ids, dtype=np.int64)
+    a, b, c = tag_ids[:-2], tag_ids[1:-1], tag_ids[2:]
+    within = (a >= 0) & (b >= 0) & (c >= 0)
+    trigram_counts = np.bincount((a[within] * m + b[within]) * m + c[within],
+                                 minlength=m ** 3).reshape(m, m, m)
+
+    lambdas = deleted_interpolation(trigram_counts, bigram_counts, tag_counts)
+    unigram = tag_counts / tag_counts.sum()
+    with np.errstate(divide='ignore', invalid='ignore'):
+        bigram = np.nan_to_num(bigram_counts / tag_counts[:, None])
+        trigram = np.nan_to_num(trigram_counts / bigram_counts[:, :, None])
+
+    # Every tag seen in training has unigram mass, so the interpolated logs are finite
+    log_trans2 = np.log((lambdas[0] * unigram + lambdas[1] * bigram) / (lambdas[0] + lambdas[1]))
+    log_trans3 = np.log(lambdas[0] * unigram + lambdas[1] * bigram[None] + lambdas[2] * trigram)
+    return TrigramTables(tables, log_trans2, log_trans3, lambdas)
+
+
+def _transitions(log_trans, *states):
+    # Gathers the block for the given tag sets; a full tag set is a plain slice, not a copy
+    m = log_trans.shape[0]
+    if all(len(s) == m for s in states):
+        return log_trans
+    return log_trans[np.ix_(*states)]
+
+
+def _prune(score, beam):
+    """
+    Keeps the `beam` best pair states and returns the masks of the prev and cur tags that
+    still take part in one, so the next step only spans those.
+    """
+    if beam and score.size > beam:
+        cutoff = np.partition(score, -beam, axis=None)[-beam]
+        score[score < cutoff] = -np.inf
+    live = score > -np.inf
+    return live.any(axis=1), live.any(axis=0)
+
+
+def viterbi_trigram(words, model, tag_dict=True, beam=None):
+    """
+    Viterbi over (prev, cur) pair states. score[j, k] is the best log-probability of a path
+    ending in tags states[t - 1][j], states[t][k]; each step is one NumPy block of shape
+    (|states t-2|, |states t-1|, |states t|), so the tag dictionary and the beam keep it small.
+    """
+    tables = model.tables
+    emit = tables.emissions(words)
+    all_tags = np.arange(len(tables.tags))
+    states = []
+    for word in words:
+        row = tables.word_index.get(word) if tag_dict else None
+        states.append(all_tags if row is None else
+                      tables.emit_indices[tables.emit_indptr[row]:tables.emit_indptr[row + 1]])
+
+    first = tables.log_prior[states[0]] + emit[0, states[0]]
+    if len(words) == 1:
+        return [tables.tags[states[0][np.argmax(first)]]]
+
+    score = first[:, None] + _transitions(model.log_trans2, states[0], states[1]) + emit[1, states[1]]
+    backpointers = []
+    for t in range(1, len(words)):
+        if t > 1:
+            candidates = score[:, :, None] + _transitions(model.log_trans3, states[t - 2], states[t - 1], states[t])
+            best = np.argmax(candidates, axis=0)
+            score = np.take_along_axis(candidates, best[None], axis=0)[0] + emit[t, states[t]]
+            backpointers.append(best)
+
+        rows, cols = _prune(score, beam)
+        if not (rows.all() and cols.all()):
+            score = score[rows][:, cols]
+            states[t - 1], states[t] = states[t - 1][rows], states[t][cols]
+            if t > 1:
+                backpointers[-1] = backpointers[-1][rows][:, cols]
+            if t > 2:
+                backpointers[-2] = backpointers[-2][:, rows]
+
+    j, k = np.unravel_index(np.argmax(score), score.shape)
+    path = [k, j]
+    for best in reversed(backpointers):
+        j, k = best[j, k], j
+        path.append(j)
+
+    return [tables.tags[states[t][i]] for t, i in enumerate(reversed(path))]
+
+
+def compare_with_bigram(model, gold_file, beams=(4, 8, 16)):
+    """Prints accuracy and speed of the trigram modes against the bigram decoders on a .pos file."""
+    sentences, gold = read_tagged_sentences(gold_file)
+    n_tokens = sum(len(s) for s in sentences)
+    tables = model.tables
+
+    modes = [
+        ("bigram", lambda s: [viterbi_log(x, tables) for x in s]),
+        ("bigram batch", lambda s: viterbi_batch(s, tables)),
+        ("bigram tag_dict", lambda s: [viterbi_pruned(x, tables) for x in s]),
+        ("trigram full", lambda s: [viterbi_trigram(x, model, tag_dict=False) for x in s]),
+        ("trigram tag_dict", lambda s: [viterbi_trigram(x, model) for x in s]),
+    ]
+    modes += [(f"trigram beam={b}", lambda s, b=b: [viterbi_trigram(x, model, tag_dict=False, beam=b) for x in s])
+              for b in beams]
+    modes += [(f"trigram tag_dict+beam={b}", lambda s, b=b: [viterbi_trigram(x, model, beam=b) for x in s])
+              for b in beams]
+
+    report = []
+    for name, decode in modes:
+        start = time.perf_counter()
+        predicted = decode(sentences)
+        elapsed = time.perf_counter() - start
+        correct = sum(p == g for ps, gs in zip(predicted, gold) for p, g in zip(ps, gs))
+        report.append({"mode": name, "accuracy": correct / n_tokens, "seconds": elapsed,
+                       "tokens_per_sec": n_tokens / elapsed})
+
+    print(f"lambdas (unigram, bigram, trigram): {', '.join(f'{x:.3f}' for x in model.lambdas)}")
+    print(f"{'mode':<28}{'accuracy':>10}{'seconds':>10}{'tok/s':>12}")
+    for row in report:
+        print(f"{row['mode']:<28}{row['accuracy']:>10.4f}{row['seconds']:>10.3f}{row['tokens_per_sec']:>12.0f}")
+    return report
+
+
+if __name__ == '__main__':
+    train_file = sys.argv[1] if len(sys.argv) > 1 else "WSJ_24.pos"
+    gold_file = sys.argv[2] if len(sys.argv) > 2 else "WSJ_24.pos"
+    compare_with_bigram(build_trigram_tables(train_file), gold_file)
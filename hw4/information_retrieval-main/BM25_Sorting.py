@@ -1,27 +1,12 @@
 import math
-import re
 from collections import Counter
-from nltk.stem import PorterStemmer
 
-from stop_list import closed_class_stop_words
-
-STOP_WORDS = set(closed_class_stop_words)
-STEMMER = PorterStemmer()
+from tokenizer import STEM_CACHE, tokenize
+from topk import impact_index, maxscore_top_k, top_docs
 
 K = 1.2
 B = 0.75
 
-def tokenize(text):
-    # keep alpha only
-    text = re.sub(r'[^a-zA-Z]+', ' ', text)
-    tokens = text.lower().split()
-    result = []
-    for t in tokens:
-        if t not in STOP_WORDS:
-            stemmed = STEMMER.stem(t)
-            result.append(stemmed)
-    return result
-
 def parse_queries(qry_file):
     """
     Reads .qry file => returns list of query strings,
@@ -91,29 +76,31 @@ def build_doc_index(docs):
     """
     docs: dict{doc_id->text}
     returns:
-      doc_tokens: dict{doc_id->list_of_tokens}
+      postings:   dict{term->list of (doc_id, tf)}, doc_ids ascending
       df_count:   Counter(term->doc_frequency)
       doc_lengths: dict{doc_id->int}
       avgdl: float
     """
-    doc_tokens = {}
+    postings = {}
     df_count = Counter()
     doc_lengths = {}
     total_length = 0
 
     for d_id, text in docs.items():
         tokens = tokenize(text)
-        doc_tokens[d_id] = tokens
         length = len(tokens)
         doc_lengths[d_id] = length
         total_length += length
 
-        unique_terms = set(tokens)
-        for t in unique_terms:
+        for t, tf in Counter(tokens).items():
+            postings.setdefault(t, []).append((d_id, tf))
             df_count[t] += 1
 
+    for plist in postings.values():
+        plist.sort()
+
     avgdl = total_length / float(len(docs)) if docs else 0.0
-    return doc_tokens, df_count, doc_lengths, avgdl
+    return postings, df_count, doc_lengths, avgdl
 
 def compute_idf(df_count, N):
     """
@@ -130,24 +117,49 @@ def compute_idf(df_count, N):
         idf_dict[term] = idf
     return idf_dict
 
-def bm25_score(query_tokens, d_id, doc_tokens, doc_lengths, idf_dict, avgdl):
+def length_norms(doc_lengths, avgdl):
+    """
+    The document part of the BM25 denominator, k*(1 - b + b*(|d|/avgdl)), once per doc
+    """
+    return {d_id: K * (1.0 - B + B * (d_len / avgdl)) for d_id, d_len in doc_lengths.items()}
+
+def bm25_scores(query_tokens, postings, norms, idf_dict):
     """
     BM25 = sum over query terms of [idf(t) * ((f*(k+1))/(f + k*(1 - b + b*(|d|/avgdl)))) ]
     where f is freq in doc, k=1.2, b=0.75
-    """
-    score = 0.0
-    freq = Counter(doc_tokens[d_id])
-    d_len = doc_lengths[d_id]
 
+    Walks the postings of the query terms only, so the cost is the number of matching
+    postings. returns dict{doc_id->score} for the docs that contain a query term.
+    """
+    scores = {}
     for t in query_tokens:
-        if t in idf_dict:
-            f = freq[t]  # raw count
-            if f > 0:
-                idf = idf_dict[t]
+        plist = postings.get(t)
+        if plist:
+            idf = idf_dict[t]
+            for d_id, f in plist:
                 numerator = f * (K + 1.0)
-                denominator = f + K * (1.0 - B + B * (d_len / avgdl))
-                score += idf * (numerator / denominator)
-    return score
+                denominator = f + norms[d_id]
+                scores[d_id] = scores.get(d_id, 0.0) + idf * (numerator / denominator)
+    return scores
+
+def bm25_impacts(postings, norms, idf_dict):
+    """
+    Each posting's BM25 term score, computed exactly as bm25_scores() does, with the
+    per-term upper bounds maxscore_top_k() needs
+    """
+    return impact_index(postings, lambda t, d_id, f: idf_dict[t] * ((f * (K + 1.0)) / (f + norms[d_id])))
+
+def rank(q_tokens, impacts, scores, doc_ids, k=100):
+    """
+    Top k docs for one query with MaxScore over impacts. With fewer than k positive scores
+    the rest are 0 or negative, which needs every match: scores(q_tokens) gives them.
+    returns (list of (doc_id, score), number of docs fully scored)
+    """
+    top, n_scored = maxscore_top_k(q_tokens, impacts, k)
+    if len(top) < k:
+        all_scores = scores(q_tokens)
+        top, n_scored = top_docs(all_scores, doc_ids, k), len(all_scores)
+    return top, n_scored
 
 def main():
     query_file = "data/cran.qry"
@@ -166,33 +178,33 @@ def main():
     print(f"Loaded {num_queries} queries and {num_docs} documents.")
 
     # 3) build doc index
-    doc_tokens, df_count, doc_lengths, avgdl = build_doc_index(docs)
+    postings, df_count, doc_lengths, avgdl = build_doc_index(docs)
 
     # 4) compute BM25 idf
     idf_dict = compute_idf(df_count, num_docs)
+    norms = length_norms(doc_lengths, avgdl)
+    impacts = bm25_impacts(postings, norms, idf_dict)
 
-    # 5) for each query, compute BM25, sort, write top 100
+    # 5) for each query, find the top 100 with MaxScore, write them
+    fully_scored = []
     with open(output_file, "w", encoding="utf-8") as outf:
         for q_index, q_text in enumerate(queries):
             q_id = q_index + 1  # 1-based
             q_tokens = tokenize(q_text)
 
-            # compute BM25 for all docs
-            results = []
-            for d_id in doc_ids:
-                score_val = bm25_score(q_tokens, d_id, doc_tokens, doc_lengths, idf_dict, avgdl)
-                results.append((d_id, score_val))
-
-            # sort descending
-            results.sort(key=lambda x: x[1], reverse=True)
-
             # *** Only keep the top 100 ***
-            top_100 = results[:100]
+            top_100, n_scored = rank(q_tokens, impacts, lambda q: bm25_scores(q, postings, norms, idf_dict),
+                                     doc_ids, 100)
+            fully_scored.append(n_scored)
 
             # output lines: <q_id> <doc_id> <score>
             for d_id, s in top_100:
                 outf.write(f"{q_id} {d_id} {s:.6f}\n")
 
+    stem_info = STEM_CACHE.info()
+    print(f"Stem cache: {stem_info['hits']} hits, {stem_info['misses']} misses ({stem_info['hit_rate']:.1%}).")
+    print(f"Fully scored {sum(fully_scored) / len(fully_scored):.1f} of {num_docs} documents per query "
+          f"on average (max {max(fully_scored)}).")
     print(f"Done. Wrote at most 100 lines per query to {output_file}.")
 
 if __name__ == "__main__":
@@ -0,0 +1,198 @@
+"""
+Persistent BM25 index for the Cranfield collection.
+
+Building the index parses, tokenizes and stems every abstract; searching only needs the
+result. "build" writes it once to a binary file, and "search" maps that file and answers
+the queries straight from it, without reading the collection or importing NLTK for words
+the collection already has.
+
+Layout: 8 byte magic, 8 byte little-endian header length, a JSON header (format version,
+BM25 parameters, avgdl and the dtype, shape and offset of each array), then every array as
+raw bytes aligned to 64 bytes. The file is opened read-only, so any number of processes
+can map it and share its pages.
+
+    python bm25_index.py build data/cran.all.1400 cran.bm25
+    python bm25_index.py search cran.bm25 data/cran.qry output.txt
+"""
+
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+from BM25_Sorting import (B, K, bm25_impacts, build_doc_index, compute_idf, length_norms, parse_abstracts,
+                          parse_queries, rank)
+from tokenizer import stem, surface_tokens, tokenize
+
+MAGIC = b"BM25IDX1"
+FORMAT_VERSION = 1
+ALIGNMENT = 64
+
+
+def _align(offset):
+    return (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+def _strings(words):
+    return np.frombuffer("\n".join(words).encode("utf-8"), dtype=np.uint8)
+
+
+def save_index(docs, path, source=None):
+    """docs: dict{doc_id->text}; writes the BM25 index of the collection to path"""
+    doc_ids = sorted(docs)
+    postings, df_count, doc_lengths, avgdl = build_doc_index(docs)
+    idf_dict = compute_idf(df_count, len(doc_ids))
+    norms = length_norms(doc_lengths, avgdl)
+    impacts = bm25_impacts(postings, norms, idf_dict)
+
+    terms = sorted(postings)
+    row = {t: i for i, t in enumerate(terms)}
+    # Every word of the collection with the term it stems to, so queries rarely need the stemmer
+    surface = sorted({w for text in docs.values() for w in surface_tokens(text)})
+
+    arrays = {
+        "terms": _strings(terms),
+        "idf": np.array([idf_dict[t] for t in terms]),
+        "max_impact": np.array([impacts[t][2] for t in terms]),
+        "post_indptr": np.cumsum([0] + [len(postings[t]) for t in terms], dtype=np.int64),
+        "post_docs": np.array([d_id for t in terms for d_id, _ in postings[t]], dtype=np.int32),
+        "post_tfs": np.array([tf for t in terms for _, tf in postings[t]], dtype=np.int32),
+        "post_impacts": np.array([impacts[t][1][d_id] for t in terms for d_id, _ in postings[t]]),
+        "doc_ids": np.array(doc_ids, dtype=np.int32),
+        "doc_lengths": np.array([doc_lengths[d_id] for d_id in doc_ids], dtype=np.int32),
+        "surface": _strings(surface),
+        "surface_terms": np.array([row[stem(w)] for w in surface], dtype=np.int32),
+    }
+
+    layout = {}
+    offset = 0
+    for name, array in arrays.items():
+        array = np.ascontiguousarray(array)
+        arrays[name] = array
+        layout[name] = {"dtype": array.dtype.str, "shape": list(array.shape), "offset": offset}
+        offset = _align(offset + array.nbytes)
+
+    header = json.dumps({"version": FORMAT_VERSION, "k": K, "b": B, "avgdl": avgdl, "source": source,
+                         "arrays": layout}).encode("utf-8")
+    data_start = _align(len(MAGIC) + 8 + len(header))
+
+    # Write beside the target and rename over it, so processes still mapping the old file are unaffected
+    tmp_path = f"{path}.tmp{os.getpid()}"
+    with open(tmp_path, "wb") as f:
+        f.write(MAGIC)
+        f.write(len(header).to_bytes(8, "little"))
+        f.write(header)
+        for name, array in arrays.items():
+            f.seek(data_start + layout[name]["offset"])
+            f.write(array.tobytes())
+        f.truncate(data_start + offset)
+    os.replace(tmp_path, path)
+    return len(terms), len(doc_ids)
+
+
+class MappedIndex:
+    """
+    A BM25 index file mapped read-only. Postings stay in the file and are only turned into
+    Python objects for the terms a query uses. Works as the impact index of maxscore_top_k().
+    """
+
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise ValueError(f"{path} is not a BM25 index")
+            header_len = int.from_bytes(f.read(8), "little")
+            header = json.loads(f.read(header_len).decode("utf-8"))
+
+        if header["version"] != FORMAT_VERSION:
+            raise ValueError(f"{path} has index format version {header['version']}, expected {FORMAT_VERSION}")
+        if (header["k"], header["b"]) != (K, B):
+            raise ValueError(f"{path} was built with k={header['k']}, b={header['b']}; rebuild it for k={K}, b={B}")
+
+        # One read-only mapping for the whole file; every array is a view into it
+        buffer = np.memmap(path, dtype=np.uint8, mode="r")
+        data_start = _align(len(MAGIC) + 8 + header_len)
+        arrays = {}
+        for name, spec in header["arrays"].items():
+            arrays[name] = np.ndarray(tuple(spec["shape"]), dtype=np.dtype(spec["dtype"]), buffer=buffer,
+                                      offset=data_start + spec["offset"])
+
+        self.path = path
+        self.avgdl = header["avgdl"]
+        self.arrays = arrays
+        self.terms = arrays["terms"].tobytes().decode("utf-8").split("\n")
+        self.term_index = {t: i for i, t in enumerate(self.terms)}
+        surface = arrays["surface"].tobytes().decode("utf-8").split("\n")
+        self.stems = dict(zip(surface, (self.terms[i] for i in arrays["surface_terms"].tolist())))
+        self.doc_ids = arrays["doc_ids"].tolist()
+        self._impacts = {}
+
+    def _range(self, term):
+        i = self.term_index[term]
+        indptr = self.arrays["post_indptr"]
+        return int(indptr[i]), int(indptr[i + 1])
+
+    def tokenize(self, text):
+        return tokenize(text, self.stems)
+
+    def __contains__(self, term):
+        return term in self.term_index
+
+    def __getitem__(self, term):
+        # (doc_ids, dict{doc_id->impact}, max impact), as impact_index() builds them
+        entry = self._impacts.get(term)
+        if entry is None:
+            start, end = self._range(term)
+            doc_ids = self.arrays["post_docs"][start:end].tolist()
+            impacts = dict(zip(doc_ids, self.arrays["post_impacts"][start:end].tolist()))
+            entry = (doc_ids, impacts, float(self.arrays["max_impact"][self.term_index[term]]))
+            self._impacts[term] = entry
+        return entry
+
+    def scores(self, query_tokens):
+        """dict{doc_id->BM25 score} of the docs that contain a query term, the same as bm25_scores()"""
+        scores = {}
+        for t in query_tokens:
+            if t in self.term_index:
+                doc_ids, impacts, _ = self[t]
+                for d_id in doc_ids:
+                    scores[d_id] = scores.get(d_id, 0.0) + impacts[d_id]
+        return scores
+
+
+def search(index_file, query_file, output_file, k=100):
+    """
+    Writes the top k of every query to output_file; returns the number of docs fully scored
+    for each query and the number of docs in the index
+    """
+    index = MappedIndex(index_file)
+    fully_scored = []
+    with open(output_file, "w", encoding="utf-8") as outf:
+        for q_index, q_text in enumerate(parse_queries(query_file)):
+            top, n_scored = rank(index.tokenize(q_text), index, index.scores, index.doc_ids, k)
+            fully_scored.append(n_scored)
+            for d_id, s in top:
+                outf.write(f"{q_index + 1} {d_id} {s:.6f}\n")
+    return fully_scored, len(index.doc_ids)
+
+
+def main(args):
+    start = time.perf_counter()
+    if len(args) == 4 and args[1] == "build":
+        n_terms, n_docs = save_index(parse_abstracts(args[2]), args[3], source=args[2])
+        print(f"Indexed {n_docs} documents, {n_terms} terms from {args[2]} into {args[3]}")
+    elif len(args) == 5 and args[1] == "search":
+        fully_scored, num_docs = search(*args[2:])
+        print(f"Fully scored {sum(fully_scored) / len(fully_scored):.1f} of {num_docs} documents per query "
+              f"on average (max {max(fully_scored)}).")
+        print(f"Wrote at most 100 lines per query to {args[4]}")
+    else:
+        print(f"usage: {args[0]} build <collection> <index file>\n"
+              f"       {args[0]} search <index file> <queries> <output file>")
+        sys.exit(1)
+    print(f"{time.perf_counter() - start:.2f}s")
+
+
+if __name__ == "__main__":
+    main(sys.argv)
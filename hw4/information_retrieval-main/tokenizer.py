@@ -0,0 +1,73 @@
+"""
+Tokenizer shared by the BM25 and TF-IDF rankers: alphabetic tokens, lowercased, closed-class
+stop words removed, Porter-stemmed.
+
+Most tokens of the Cranfield abstracts are repeats, so stems go through a bounded LRU cache
+and every distinct word is stemmed once. STEM_CACHE.info() gives its hit rate.
+"""
+
+import re
+from collections import OrderedDict
+
+from stop_list import closed_class_stop_words
+
+NON_ALPHA = re.compile(r'[^a-zA-Z]+')
+STOP_WORDS = frozenset(closed_class_stop_words)
+
+_stemmer = None
+
+
+def porter_stem(token):
+    # NLTK takes seconds to import, so the stemmer is only created once something needs stemming
+    global _stemmer
+    if _stemmer is None:
+        from nltk.stem import PorterStemmer
+        _stemmer = PorterStemmer()
+    return _stemmer.stem(token)
+
+
+class StemCache:
+    def __init__(self, maxsize=65536):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()        # word -> stem, least recently used first
+        self.hits = 0
+        self.misses = 0
+
+    def stem(self, token):
+        stemmed = self.entries.get(token)
+        if stemmed is None:
+            self.misses += 1
+            stemmed = self.entries[token] = porter_stem(token)
+            if len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+        else:
+            self.hits += 1
+            self.entries.move_to_end(token)
+        return stemmed
+
+    def info(self):
+        lookups = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses, "size": len(self.entries), "maxsize": self.maxsize,
+                "hit_rate": self.hits / lookups if lookups else 0.0}
+
+
+STEM_CACHE = StemCache()
+
+
+def stem(token):
+    return STEM_CACHE.stem(token)
+
+
+def surface_tokens(text):
+    # keep alpha only
+    return [t for t in NON_ALPHA.sub(' ', text).lower().split() if t not in STOP_WORDS]
+
+
+def tokenize(text, known_stems=None):
+    """
+    Lowercased alphabetic tokens without stop words, stemmed. known_stems: optional
+    dict{word->stem}; words found in it skip the stemmer and the cache
+    """
+    if known_stems is None:
+        return [STEM_CACHE.stem(t) for t in surface_tokens(text)]
+    return [known_stems[t] if t in known_stems else STEM_CACHE.stem(t) for t in surface_tokens(text)]
@@ -0,0 +1,137 @@
+import heapq
+from bisect import bisect_right
+
+import numpy as np
+
+
+def top_docs(scores, doc_ids, k=100):
+    """
+    scores: dict{doc_id->score} for the docs that match the query
+    returns the same top k as scoring every doc and stably sorting by score: docs that
+    match nothing score 0 and, in doc_id order, sit between the positive and the negative
+    scores. Uses bounded heaps, O(matches * log k), instead of sorting everything.
+    """
+    positive = heapq.nsmallest(k, ((-s, d) for d, s in scores.items() if s > 0))
+    results = [(d, -s) for s, d in positive]
+    if len(results) == k:
+        return results
+
+    for d_id in doc_ids:
+        if len(results) == k:
+            return results
+        if scores.get(d_id, 0.0) == 0:
+            results.append((d_id, 0.0))
+
+    negative = heapq.nsmallest(k - len(results), ((-s, d) for d, s in scores.items() if s < 0))
+    return results + [(d, -s) for s, d in negative]
+
+
+def top_k_indices(scores, k=100):
+    """
+    scores: 1-d array over every doc
+    returns the same indices as np.argsort(-scores, kind='stable')[:k], but selects the k
+    best with a partition, O(n), and only sorts those
+    """
+    if k >= len(scores):
+        return np.argsort(-scores, kind='stable')
+    kth = np.partition(scores, len(scores) - k)[len(scores) - k]
+    above = np.flatnonzero(scores > kth)
+    # Ties at the k-th score go to the lowest indices, as in the stable sort
+    tied = np.flatnonzero(scores == kth)[:k - len(above)]
+    chosen = np.concatenate([above, tied])
+    return chosen[np.lexsort((chosen, -scores[chosen]))]
+
+
+def impact_index(postings, impact):
+    """
+    postings: dict{term->list of (doc_id, tf)}, doc_ids ascending
+    impact:   function(term, doc_id, tf) -> that posting's share of a doc's score
+    returns dict{term->(doc_ids, dict{doc_id->impact}, max impact)}; the max is the term's
+    score upper bound
+    """
+    index = {}
+    for term, plist in postings.items():
+        impacts = {d_id: impact(term, d_id, tf) for d_id, tf in plist}
+        index[term] = ([d_id for d_id, _ in plist], impacts, max(impacts.values()))
+    return index
+
+
+def maxscore_top_k(query_terms, index, k=100):
+    """
+    Top k docs by positive score, where a doc's score is the sum of its impacts over
+    query_terms (a repeated term counts every time, in query order, as a full scan would).
+
+    MaxScore, document at a time: terms are ordered by upper bound, and the terms whose
+    bounds add up to less than the current k-th best score are non-essential, since a doc
+    that has only those cannot make the top k. Candidates come from the essential terms
+    only, and a candidate is fully scored only if its partial score plus the bounds of the
+    non-essential terms can still reach the top k.
+
+    returns (list of (doc_id, score) best first, ties by doc_id, number of docs fully scored)
+    """
+    counts = {}
+    for t in query_terms:
+        if t in index:
+            counts[t] = counts.get(t, 0) + 1
+    # Non-negative bounds, so a term with only negative impacts never makes a doc look better
+    terms = sorted(counts, key=lambda t: counts[t] * max(index[t][2], 0.0))
+    prefix = [0.0]
+    for t in terms:
+        prefix.append(prefix[-1] + counts[t] * max(index[t][2], 0.0))
+    exact = [index[t][1] for t in query_terms if t in index]
+
+    heap = []                           # (score, -doc_id): the k-th best is heap[0]
+    threshold = 0.0                     # only positive scores qualify
+    first_essential = 0
+    fully_scored = 0
+    last_doc = float("-inf")
+
+    while first_essential < len(terms):
+        # Candidates: the docs after last_doc in any essential term's postings, in doc_id order
+        essential = [(counts[t], index[t][1]) for t in terms[first_essential:]]
+        lists = [index[t][0][bisect_right(index[t][0], last_doc):] for t in terms[first_essential:]]
+        non_essential_bound = prefix[first_essential]
+        narrowed = False
+
+        previous = None
+        for d_id in heapq.merge(*lists):
+            if d_id == previous:
+                continue
+            previous = d_id
+
+            partial = non_essential_bound
+            for count, impacts in essential:
+                value = impacts.get(d_id)
+                if value is not None:
+                    partial += count * value
+            # Bounds are sums in a different order than the score, so keep a rounding margin
+            if partial < threshold - 1e-9 * (1.0 + abs(threshold)):
+                continue
+
+            fully_scored += 1
+            score = 0.0
+            for impacts in exact:
+                value = impacts.get(d_id)
+                if value is not None:
+                    score += value
+
+            # Docs come in doc_id order, so a later doc with an equal score never displaces one
+            if score > threshold:
+                if len(heap) == k:
+                    heapq.heapreplace(heap, (score, -d_id))
+                else:
+                    heapq.heappush(heap, (score, -d_id))
+                if len(heap) == k:
+                    threshold = heap[0][0]
+                    if prefix[first_essential + 1] < threshold:
+                        # Another term became non-essential: restart the candidates without it
+                        while first_essential < len(terms) and prefix[first_essential + 1] < threshold:
+                            first_essential += 1
+                        last_doc = d_id
+                        narrowed = True
+                        break
+        if not narrowed:
+            break
+
+    results = sorted(((-d, s) for s, d in heap), key=lambda x: (-x[1], x[0]))
+    return results, fully_scored
@@ -1,19 +1,10 @@
-import re
-import math
 from collections import Counter
-from nltk.stem import PorterStemmer
 
-from stop_list import closed_class_stop_words
+import numpy as np
+from scipy.sparse import csr_matrix
 
-STOP_WORDS = set(closed_class_stop_words)
-STEMMER = PorterStemmer()
-
-
-def tokenize(text):
-    text = re.sub(r'[^a-zA-Z]+', ' ', text)  # Keep only letters
-    tokens = text.lower().split()
-    result = [STEMMER.stem(t) for t in tokens if t not in STOP_WORDS]
-    return result  # Return as a list of tokens
+from tokenizer import STEM_CACHE, tokenize
+from topk import top_k_indices
 
 
 def parse_queries(qry_file):
@@ -69,59 +60,70 @@ def parse_abstracts(doc_file):
 
 
 def compute_tfidf(docs):
-    doc_tokens = {d_id: tokenize(text) for d_id, text in docs.items()}
-    doc_term_counts = {d_id: Counter(tokens) for d_id, tokens in doc_tokens.items()}
-    doc_lengths = {d_id: len(tokens) for d_id, tokens in doc_tokens.items()}
-    all_terms = set(term for tokens in doc_tokens.values() for term in tokens)
-
-    # Compute document frequency (df) for each term
-    df_count = Counter()
-    for tokens in doc_tokens.values():
-        unique_terms = set(tokens)
-        for term in unique_terms:
-            df_count[term] += 1
+    """
+    Builds the TF-IDF document-term matrix.
+    Returns: (CSR matrix with one row per doc in doc_ids order, doc_ids, vocab{term->column},
+              idf array by column, L2 norm of every row)
+    """
+    doc_ids = list(docs)
+    doc_term_counts = [Counter(tokenize(docs[d_id])) for d_id in doc_ids]
+    vocab = {term: j for j, term in enumerate(sorted(set(term for counts in doc_term_counts for term in counts)))}
+
+    rows, cols, tf = [], [], []
+    for i, term_count in enumerate(doc_term_counts):
+        doc_length = sum(term_count.values())
+        for term, count in term_count.items():
+            rows.append(i)
+            cols.append(vocab[term])
+            tf.append(count / doc_length)
+    cols = np.array(cols, dtype=np.int64)
 
     N = len(docs)  # Total number of documents
 
-    # Compute IDF values
-    idf = {term: math.log(N / (df_count[term] + 1)) for term in all_terms}
+    # Compute document frequency (df) and IDF values for each term
+    df_count = np.bincount(cols, minlength=len(vocab))
+    idf = np.log(N / (df_count + 1))
 
-    # Compute TF-IDF for each document
-    doc_tfidf = {}
-    for d_id, term_count in doc_term_counts.items():
-        tfidf_scores = {term: (count / doc_lengths[d_id]) * idf[term] for term, count in term_count.items()}
-        doc_tfidf[d_id] = tfidf_scores
+    doc_matrix = csr_matrix((np.array(tf) * idf[cols], (rows, cols)), shape=(N, len(vocab)))
+    doc_norms = np.sqrt(doc_matrix.multiply(doc_matrix).sum(axis=1)).A1
+    return doc_matrix, doc_ids, vocab, idf, doc_norms
 
-    return doc_tfidf, idf, all_terms
 
+def query_matrix(queries, vocab, idf):
+    """TF-IDF matrix of the queries over the document vocabulary; terms no document has get weight 0."""
+    rows, cols, tf = [], [], []
+    for i, query in enumerate(queries):
+        query_tokens = tokenize(query)
+        for term, count in Counter(query_tokens).items():
+            if term in vocab:
+                rows.append(i)
+                cols.append(vocab[term])
+                tf.append(count / len(query_tokens))
+    cols = np.array(cols, dtype=np.int64)
+    return csr_matrix((np.array(tf) * idf[cols], (rows, cols)), shape=(len(queries), len(vocab)))
 
-def compute_cosine_similarity(query, doc_tfidf, idf, all_terms):
+
+def compute_cosine_similarity(queries, doc_matrix, doc_ids, vocab, idf, doc_norms, k=100):
     """
-    Computes cosine similarity between a query and all documents.
-    Returns: List of (doc_id, similarity_score), sorted in descending order.
+    Computes cosine similarity between every query and every document as one sparse
+    matrix product.
+    Returns: for each query, its top k (doc_id, similarity_score), sorted in descending order.
     """
-    query_tokens = tokenize(query)
-    query_tf = Counter(query_tokens)
-
-    # Compute query TF-IDF vector
-    query_tfidf = {term: (query_tf[term] / len(query_tokens)) * idf.get(term, 0) for term in query_tf}
+    queries_tfidf = query_matrix(queries, vocab, idf)
+    query_norms = np.sqrt(queries_tfidf.multiply(queries_tfidf).sum(axis=1)).A1
 
-    # Compute cosine similarity
-    scores = {}
-    for d_id, doc_vector in doc_tfidf.items():
-        dot_product = sum(query_tfidf.get(term, 0) * doc_vector.get(term, 0) for term in all_terms)
-        doc_magnitude = math.sqrt(sum(val ** 2 for val in doc_vector.values()))
-        query_magnitude = math.sqrt(sum(val ** 2 for val in query_tfidf.values()))
+    dot_products = (queries_tfidf @ doc_matrix.T).toarray()
+    magnitudes = np.outer(query_norms, doc_norms)
 
-        # Avoid division by zero
-        if doc_magnitude > 0 and query_magnitude > 0:
-            scores[d_id] = dot_product / (doc_magnitude * query_magnitude)
-        else:
-            scores[d_id] = 0.0
+    # Avoid division by zero
+    scores = np.divide(dot_products, magnitudes, out=np.zeros_like(dot_products), where=magnitudes > 0)
 
-    # Sort by similarity score in descending order
-    ranked_results = sorted(scores.items(), key=lambda x: x[1], reverse=True)
-    return ranked_results[:100]  # Keep only top 100
+    # Only the top k of each row are sorted; equal scores keep document order
+    ranked_results = []
+    for query_scores in scores:
+        order = top_k_indices(query_scores, k)
+        ranked_results.append([(doc_ids[j], query_scores[j]) for j in order])
+    return ranked_results
 
 
 def main():
@@ -135,14 +137,12 @@ def main():
     print(f"Loaded {len(queries)} queries and {len(docs)} documents.")
 
     # Compute TF-IDF for all documents
-    doc_tfidf, idf, all_terms = compute_tfidf(docs)
+    doc_matrix, doc_ids, vocab, idf, doc_norms = compute_tfidf(docs)
 
-    # Compute cosine similarity for each query
+    # Compute cosine similarity for all queries at once
     ranked_results = []
-    for q_index, query_text in enumerate(queries):
+    for q_index, top_docs in enumerate(compute_cosine_similarity(queries, doc_matrix, doc_ids, vocab, idf, doc_norms)):
         q_id = q_index + 1  # 1-based index
-        top_docs = compute_cosine_similarity(query_text, doc_tfidf, idf, all_terms)
-
         for d_id, score in top_docs:
             ranked_results.append(f"{q_id} {d_id} {score:.6f}")
 
@@ -150,6 +150,8 @@ def main():
         for line in ranked_results:
             outf.write(line + "\n")
 
+    stem_info = STEM_CACHE.info()
+    print(f"Stem cache: {stem_info['hits']} hits, {stem_info['misses']} misses ({stem_info['hit_rate']:.1%}).")
     print(f"Finished")
 
 